@@ -8,6 +8,8 @@
 
 import os
 import sys
+import argparse
+import time
 
 sys.path.append("../scripts")
 
@@ -17,26 +19,173 @@ import plotly.graph_objects as go
 import pandas as pd
 import feather
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 
 from TSVContainer import TSVContainer
-from ProcessDirectory import processDirectory
+from ProcessDirectory import processDirectory, readWeightFactors
+from DashboardSync import syncDirectory, replaceFile
+from ResultsTable import ResultsTable
+from WeightSweep import sweep, readCandidates, randomFactors
 from colorama import *
 from PrintFuncs import *
 
-BADGES = {
-    0: "Failed",
-    1: "Perfect",
-    2: "Good",
-    99: "Not Possible"
-}
+# norms of the last evaluation run, for --rescore and --sweep
+RESULTS_TABLE_FILE = "ResultNorms.pickle"
+# results of --sweep
+SWEEP_FILE = "WeightSweep.tsv"
+
+def processTestCases(testCaseDirs, jobs, toolJobs=1, cacheDir=None, reportNorms=None):
+    """
+    Processes all given test case directories, either one after another (jobs = 1)
+    or concurrently in a pool of 'jobs' worker processes. Within each test case,
+    'toolJobs' worker processes evaluate the tool result files concurrently.
+    With a 'cacheDir' given, unchanged results are taken from the result cache.
+    Norms without weight are only calculated if listed in 'reportNorms', None
+    means all norms.
+
+    Returns a dictionary with the results of all test cases. The dictionary is filled
+    in the order of 'testCaseDirs', regardless of the order in which the worker
+    processes finish, so that all generated output is identical to a serial run.
+    """
+    testresults = dict()
+    if jobs <= 1:
+        for sd in testCaseDirs:
+            printNotification("\n################################################\n")
+            printNotification("Processing directory '{}'".format(sd))
+            try:
+                testresults[sd] = processDirectory(os.path.join(os.getcwd(), sd), toolJobs, cacheDir, reportNorms)
+            except Exception as e:
+                printError(str(e))
+                raise Exception(f"Could not process data in directory {sd}")
+        return testresults
 
-def scoreCalculation():
-    # Create results file
+    printNotification("\n################################################\n")
+    printNotification("Processing {} test cases with {} worker processes".format(len(testCaseDirs), jobs))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = dict()
+        for sd in testCaseDirs:
+            futures[sd] = executor.submit(processDirectory, os.path.join(os.getcwd(), sd), toolJobs, cacheDir,
+                                       reportNorms)
+        # collect results in fixed order
+        for sd in testCaseDirs:
+            try:
+                testresults[sd] = futures[sd].result()
+            except Exception as e:
+                printError(str(e))
+                raise Exception(f"Could not process data in directory {sd}")
+    return testresults
+
+
+def exportVariableFiles(dashDir, testcase, results):
+    """
+    Writes the data of each tool and variable to a feather file '<variable>/<ToolID>.ftr'
+    in the dashboard directory of the test case. The reference results of a variable are
+    written once to '<variable>/Reference.ftr', taken from the last tool of the variable.
+    """
+    references = dict()
+    for var in results:
+        if var.Data.empty:
+            continue
+        testCaseDir = os.path.join(dashDir, testcase)
+        if not os.path.exists(testCaseDir):
+            os.mkdir(testCaseDir)
+        variableDir = os.path.join(testCaseDir, var.Variable)
+        if not os.path.exists(variableDir):
+            os.mkdir(variableDir)
+        file = os.path.join(dashDir, testcase, var.Variable, var.ToolID + ".ftr")
+        try:
+            df = var.Data.reset_index()
+            replaceFile(file, df.to_feather)
+        except Exception as e:
+            printError(e)
+            printError("Could not convert panda data to feather data.")
+            continue
+        references[var.Variable] = var
+
+    for variable, var in references.items():
+        refFile = os.path.join(dashDir, testcase, variable, "Reference.ftr")
+        try:
+            dfRef = var.RefData.reset_index()
+            replaceFile(refFile, dfRef.to_feather)
+        except Exception as e:
+            printError(e)
+            printError("Could not convert panda data to feather data.")
+
+
+def exportTestCaseFile(dashDir, testcase, results):
+    """
+    Writes the data of all tools and variables of a test case to the single feather file
+    'Data.ftr' in the dashboard directory of the test case, with the columns 'Variable',
+    'ToolID', 'index' and 'Data'. The reference results of each variable are stored once
+    with ToolID 'Reference' (taken from the last tool, like in exportVariableFiles()).
+
+    Rows of a variable and tool are contiguous, 'DataIndex.ftr' lists the first row and the
+    row count for each of them. Both files are uncompressed, so they can be memory-mapped.
+    """
+    # group the results by variable, in the order of the results
+    variables = dict()
+    for var in results:
+        if var.Data.empty:
+            continue
+        variables.setdefault(var.Variable, []).append(var)
+
+    frames = []
+    index = []
+    rowCount = 0
+    for variable, varResults in variables.items():
+        parts = [(var.ToolID, var.Data) for var in varResults]
+        parts.append(("Reference", varResults[-1].RefData))
+        for toolID, data in parts:
+            df = data.reset_index()
+            df.insert(0, "ToolID", toolID)
+            df.insert(0, "Variable", variable)
+            frames.append(df)
+            index.append((variable, toolID, rowCount, len(df)))
+            rowCount += len(df)
+
+    testCaseDir = os.path.join(dashDir, testcase)
+    if not os.path.exists(testCaseDir):
+        os.mkdir(testCaseDir)
     try:
-        fobj = open("../dash_data/Results.tsv", "w", encoding="utf-8")
-    except IOError as e:
-        print(e)
-        print("Cannot create 'Results.tsv' file")
+        if len(frames) > 0:
+            data = pd.concat(frames, ignore_index=True)
+        else:
+            data = pd.DataFrame(columns=["Variable", "ToolID", "index", "Data"])
+        data["Variable"] = data["Variable"].astype("category")
+        data["ToolID"] = data["ToolID"].astype("category")
+        replaceFile(os.path.join(testCaseDir, "Data.ftr"),
+                    lambda fname: data.to_feather(fname, compression="uncompressed"))
+        dataIndex = pd.DataFrame(index, columns=["Variable", "ToolID", "First Row", "Row Count"])
+        replaceFile(os.path.join(testCaseDir, "DataIndex.ftr"),
+                    lambda fname: dataIndex.to_feather(fname, compression="uncompressed"))
+    except Exception as e:
+        printError(e)
+        printError("Could not convert panda data to feather data.")
+
+
+def writeResults(dashDir, table):
+    """
+    Writes 'Results.tsv' of the ResultsTable. The file is replaced, not written in place,
+    since it may be hard-linked into the dashboard checkout.
+    """
+    def write(fname):
+        with open(fname, "w", encoding="utf-8") as fobj:
+            table.writeTsv(fobj)
+    replaceFile(os.path.join(dashDir, "Results.tsv"), write)
+
+
+def copyWeightFactors(testcase, dashDir):
+    """Copies 'WeightFactors.tsv' of the test case into its dashboard directory."""
+    replaceFile(os.path.join(dashDir, testcase, "WeightFactors.tsv"),
+                lambda fname: shutil.copy2(os.path.join(testcase, "WeightFactors.tsv"), fname))
+
+
+def scoreCalculation(jobs=1, toolJobs=1, cacheDir=None, fullReport=True, exportMode="files", linkFiles=False):
+    # 'Results.tsv' is only written once all test cases are evaluated, but a missing
+    # dashboard data directory is reported right away
+    dashDir = "../dash_data/"
+    if not os.path.isdir(dashDir):
+        print("Cannot create 'Results.tsv' file, directory '{}' does not exist".format(dashDir))
         exit(1)
 
     # Create log file
@@ -52,66 +201,37 @@ def scoreCalculation():
     # initialize colored console output
     init()
 
-    # create dictionary for test case results
-    testresults = dict()
-
-    # process all subdirectories of `AP4` (i.e. test cases)
+    # collect all subdirectories of `AP4` (i.e. test cases)
     subdirs = os.listdir(os.curdir)
-    try:
-        # process all subdirectory starting with TF
-        for sd in subdirs:
-            if len(sd) > 4 and sd.startswith("TF"):
-                # extract next two digits and try to convert to a number
-                try:
-                    testCaseNumber = int(sd[2:3])
-                except:
-                    printError("Malformed directory name: {}".format(sd))
-                    continue
-                printNotification("\n################################################\n")
-                printNotification("Processing directory '{}'".format(sd))
-                testresults[sd] = processDirectory(os.path.join(os.getcwd(), sd))
-    except Exception as e:
-        fobj.close()
-        del fobj
-        printError(str(e))
-        raise Exception(f"Could not process data in directory {sd}")
-
-    # dump test results into file
-
-    fobj.write(
-        "Test Case\tVariable\tToolID\tTool Name\tVersion\tUnit\tEditor\tFehlercode\t"
-        "Average [-]\tCVRMSE [%]\tDaily Amplitude CVRMSE [%]\tMBE\tMSE [%]\tMax Difference [-]\tMaximum [-]\tMinimum [-]\tNMBE [%]\tNRMSE [%]\tR squared [-]\tRMSE [%]\tRMSEIQR [%]\tRMSLE [%]\tstd dev [-]"
-        "\tReference\tSimQ-Score [%]\tSimQ-Rating\n"
-    )
-
-    testcases = sorted(testresults.keys())
-
-    colors = dict()
-
-    for testcase in testcases:
-        testData = testresults[testcase]
-        # skip test cases with missing/invalid 'Reference.tsv'
-        if testData == None:
-            continue
-        for td in testData:
-            resText = "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t".format(td.TestCase, td.Variable, td.ToolID, td.DisplayName,
-                                                            td.Version, td.Unit, td.Editor, td.ErrorCode)
-
-            sortedKeys = sorted(td.norms.keys())
+    testCaseDirs = []
+    # process all subdirectory starting with TF
+    for sd in subdirs:
+        if len(sd) > 4 and sd.startswith("TF"):
+            # extract next two digits and try to convert to a number
+            try:
+                testCaseNumber = int(sd[2:3])
+            except:
+                printError("Malformed directory name: {}".format(sd))
+                continue
+            testCaseDirs.append(sd)
 
-            for n in sortedKeys:
-                if n == "Sum":
-                    continue
-                resText = resText + "{}\t".format(td.norms[n])
-            resText = resText + "{}\t".format(td.Reference)
-            resText = resText + "{}\t".format(td.score)
-            resText = resText + "{}\n".format(BADGES.get(td.simQbadge))
-            fobj.write(resText)
+    # create dictionary for test case results
+    # without full report only the norms needed for the score are calculated
+    reportNorms = None if fullReport else []
+    testresults = processTestCases(testCaseDirs, jobs, toolJobs, cacheDir, reportNorms)
 
-            colors[td.ToolID] = td.DisplayColor
+    # dump test results into file
+    table = ResultsTable.fromTestResults(testresults)
+    try:
+        writeResults(dashDir, table)
+    except IOError as e:
+        print(e)
+        print("Cannot create 'Results.tsv' file")
+        exit(1)
+    colors = table.toolColors()
+    # norms are kept for rescoring with other weight factors
+    table.save(RESULTS_TABLE_FILE)
 
-    fobj.close()
-    del fobj
     printNotification("\n################################################\n")
 
     printNotification("\nConvert data for SimQuality Dashboard\n")
@@ -120,9 +240,6 @@ def scoreCalculation():
     # pandaResults = dict()
     # convertToPandas()
 
-    dashDir = "../dash_data/"
-    dataDir = "../data/"
-
     for testcase in testresults.keys():
         if testresults[testcase] is None:
             continue
@@ -132,30 +249,20 @@ def scoreCalculation():
         printNotification(f"\n------------------------------------\n")
         printNotification(f"Converting all data for test Case {testcase}")
 
-        path1 = os.path.join(dataDir, testcase, "WeightFactors.tsv")
-        path2 = os.path.join(dashDir, testcase, "WeightFactors.tsv")
+        copyWeightFactors(testcase, dashDir)
 
-        shutil.copy2(path1, path2)
+        if exportMode == "testcase":
+            exportTestCaseFile(dashDir, testcase, testresults[testcase])
+        else:
+            exportVariableFiles(dashDir, testcase, testresults[testcase])
 
-        for var in testresults[testcase]:
-            if var.Data.empty:
-                continue
-            testCaseDir = os.path.join(dashDir, testcase)
-            if not os.path.exists(testCaseDir):
-                os.mkdir(testCaseDir)
-            variableDir = os.path.join(testCaseDir, var.Variable)
-            if not os.path.exists(variableDir):
-                os.mkdir(variableDir)
-            file = os.path.join(dashDir, testcase, var.Variable, var.ToolID + ".ftr")
-            refFile = os.path.join(dashDir, testcase, var.Variable, "Reference.ftr")
-            try:
-                df = var.Data.reset_index()
-                dfRef = var.RefData.reset_index()
-                df.to_feather(file)
-                dfRef.to_feather(refFile)
-            except Exception as e:
-                printError(e)
-                printError("Could not convert panda data to feather data.")
+    if exportMode == "testcase":
+        # columnar results table next to 'Results.tsv'
+        try:
+            replaceFile(os.path.join(dashDir, "Results.ftr"), table.writeFeather)
+        except Exception as e:
+            printError(str(e))
+            printError("Could not write results table as feather file.")
 
     printNotification("\n################################################\n\n")
     printNotification("Done producing evaluation data and dash conversion.")
@@ -170,17 +277,122 @@ def scoreCalculation():
     try:
         resultFile = "ToolColors.tsv"
         colorDf = pd.DataFrame.from_dict(colors, orient='index')
-        colorDf.to_csv(os.path.join(dashDir, resultFile), sep="\t", header=False)
+        replaceFile(os.path.join(dashDir, resultFile), lambda fname: colorDf.to_csv(fname, sep="\t", header=False))
     except Exception as e:
         printError(str(e))
         raise Exception(f"Could not create tool color file {colorDf}.")
 
-    shutil.copytree(path1, path2, dirs_exist_ok=True)
+    syncDashboard(path1, path2, linkFiles)
+
+
+def syncDashboard(dashDir, targetDir, linkFiles=False):
+    """Copies the changed files in the dashboard data directory to the dashboard checkout."""
+    report = syncDirectory(dashDir, targetDir, linkFiles)
+    printNotification("Dashboard data synchronized: {}".format(report.summary()))
+    for path in report.copied + report.linked:
+        print("  updated {}".format(path))
+    for path in report.deleted:
+        print("  deleted {}".format(path))
+
+
+def rescoreResults(linkFiles=False):
+    """
+    Calculates the scores of the last evaluation run again with the current weight factors of
+    all test cases, using the norms stored in RESULTS_TABLE_FILE. The data of the test cases is
+    not evaluated again, only 'Results.tsv' and the weight factors in the dashboard data change.
+
+    Nothing is written if the weight factors need norms that were not calculated in the last
+    evaluation run, see ResultsTable.rescore().
+    """
+    init()
+    table = ResultsTable.load(RESULTS_TABLE_FILE)
+
+    dashDir = "../dash_data/"
+    testCaseDirs = sorted(set(table.data["TestCaseDir"].tolist()))
+    weightFactors = dict()
+    for testcase in testCaseDirs:
+        weightFactors[testcase] = readWeightFactors(testcase)
+    table = table.rescore(weightFactors)
+
+    writeResults(dashDir, table)
+    if os.path.exists(os.path.join(dashDir, "Results.ftr")):
+        replaceFile(os.path.join(dashDir, "Results.ftr"), table.writeFeather)
+    for testcase in testCaseDirs:
+        copyWeightFactors(testcase, dashDir)
+    printNotification("Rescored {} results of {} test cases.".format(len(table), len(testCaseDirs)))
+
+    syncDashboard("../dash_data", "../../SimQuality-Dashboard/dash_data", linkFiles)
+
+def sweepWeightFactors(candidates):
+    """
+    Evaluates candidate weight factors with the norms of the last evaluation run and writes the
+    badge changes and score distribution of each candidate to SWEEP_FILE. 'candidates' is either
+    a file with candidate weight factors (see readCandidates()), or the number of random variations
+    of the current weight factors of each test case.
+    """
+    init()
+    table = ResultsTable.load(RESULTS_TABLE_FILE)
+
+    weightFactors = dict()
+    for testcase in sorted(set(table.data["TestCaseDir"].tolist())):
+        weightFactors[testcase] = readWeightFactors(testcase)
+
+    if candidates.isdigit():
+        weights = randomFactors(int(candidates))
+        relative = True
+    else:
+        weights = readCandidates(candidates)
+        relative = False
+
+    start = time.perf_counter()
+    summary = sweep(table, weightFactors, weights, relative)
+    printNotification("Evaluated {} candidate weight factors in {:.2f} s.".format(len(weights),
+                                                                                time.perf_counter() - start))
+    summary.to_csv(SWEEP_FILE, sep="\t", index=False)
+    if len(summary) > 0:
+        changes = summary["Badge Changes"]
+        results = summary.loc[0, ["Perfect", "Good", "Failed"]].astype(int).sum()
+        printNotification("Badge changes: min {}, median {:g}, max {} of {} results".format(
+            changes.min(), changes.median(), changes.max(), results))
+    printNotification("Results written to '{}'.".format(SWEEP_FILE))
+
 
 # ---*** main ***---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluates all SimQuality test cases and generates the score file.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of test cases processed in parallel worker processes (default: 1, serial run)")
+    parser.add_argument("-t", "--tool-jobs", type=int, default=1,
+                        help="Number of tool result files of a test case evaluated in parallel worker processes "
+                             "(default: 1, serial run)")
+    parser.add_argument("-c", "--cache", metavar="DIR", default=None,
+                        help="Directory of the persistent result cache, only results of changed input files are "
+                             "recomputed and parsed tool result files are kept in binary form (default: no caching)")
+    parser.add_argument("--export", choices=["files", "testcase"], default="files",
+                        help="Dashboard data export: 'files' writes one feather file per tool and variable, "
+                             "'testcase' writes a single feather file with all data per test case "
+                             "(default: files)")
+    parser.add_argument("--link", action="store_true",
+                        help="Hard-link changed files into the dashboard checkout instead of copying them")
+    parser.add_argument("--rescore", action="store_true",
+                        help="Only calculate the scores again with the current weight factors, from the norms "
+                             "of the last evaluation run")
+    parser.add_argument("--sweep", metavar="CANDIDATES", default=None,
+                        help="Evaluate candidate weight factors with the norms of the last evaluation run: a "
+                             "tab-separated file with one candidate per row and the norms as columns, or the number "
+                             "of random variations of the current weight factors. Results go to '{}'".format(SWEEP_FILE))
+    parser.add_argument("--full-report", action="store_true",
+                        help="Calculate all norms for 'Results.tsv', by default only the norms that contribute to "
+                             "the score are calculated and all other norm columns are left empty")
+    args = parser.parse_args()
+
     try:
-        scoreCalculation()
+        if args.sweep is not None:
+            sweepWeightFactors(args.sweep)
+        elif args.rescore:
+            rescoreResults(args.link)
+        else:
+            scoreCalculation(args.jobs, args.tool_jobs, args.cache, args.full_report, args.export, args.link)
     except Exception as e:
         printError(str(e))
         printError("Could not evaluate SimQuality results.")
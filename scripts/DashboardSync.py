@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Incremental synchronization of the dashboard data directory with the
+# checkout of the SimQuality dashboard.
+#
+# A manifest in the target directory lists the content hash of every file
+# that was synchronized. Only files with changed content are copied (or
+# hard-linked), files that were removed from the source directory are
+# deleted from the target directory. Files in the target directory that
+# are not listed in the manifest are never touched.
+#
+# Hard-linked files are shared by both directories, so files in the source
+# directory must never be written in place. replaceFile() writes a new
+# file and replaces the old one, which breaks the link.
+
+import os
+import json
+import shutil
+
+from ResultCache import fileHash
+from PrintFuncs import *
+
+MANIFEST_FILE = ".dash_manifest.json"
+MANIFEST_VERSION = 1
+
+
+class SyncReport:
+    """Relative paths of the files handled by syncDirectory(), grouped by action."""
+
+    def __init__(self):
+        self.copied = []
+        self.linked = []
+        self.deleted = []
+        self.unchanged = []
+
+    def summary(self):
+        return "{} copied, {} linked, {} deleted, {} unchanged".format(
+            len(self.copied), len(self.linked), len(self.deleted), len(self.unchanged))
+
+
+def replaceFile(fname, write):
+    """
+    Calls write() with the name of a temporary file, which then replaces the file 'fname'.
+    A hard link to the old file keeps the old content, and if write() fails the old file
+    is left unchanged.
+    """
+    tmpName = fname + ".tmp"
+    try:
+        write(tmpName)
+        os.replace(tmpName, fname)
+    finally:
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+
+
+def readManifest(targetDir):
+    """Returns the manifest entries of the target directory, an empty dictionary if there is no valid manifest."""
+    fname = os.path.join(targetDir, MANIFEST_FILE)
+    if not os.path.exists(fname):
+        return dict()
+    try:
+        with open(fname) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["files"]
+    except (IOError, ValueError, KeyError) as e:
+        printWarning("Cannot read sync manifest '{}', all files are compared: {}".format(fname, str(e)))
+    return dict()
+
+
+def writeManifest(targetDir, files):
+    fname = os.path.join(targetDir, MANIFEST_FILE)
+    tmpName = fname + ".tmp"
+    with open(tmpName, 'w') as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmpName, fname)
+
+
+def listFiles(sourceDir):
+    """Returns the paths of all files in 'sourceDir', relative to 'sourceDir' and with '/' as separator."""
+    files = []
+    for root, dirs, fnames in os.walk(sourceDir):
+        dirs.sort()
+        for fname in sorted(fnames):
+            path = os.path.relpath(os.path.join(root, fname), sourceDir)
+            files.append(path.replace(os.sep, "/"))
+    return files
+
+
+def syncDirectory(sourceDir, targetDir, link=False):
+    """
+    Synchronizes 'targetDir' with the content of 'sourceDir' and returns a SyncReport.
+
+    Files are copied (hard-linked if 'link' is True and possible) only if their content
+    differs from the content recorded in the manifest of the target directory, or if the
+    file in the target directory was modified or removed since. Source files with unchanged
+    size and modification time are not hashed again.
+    """
+    report = SyncReport()
+    os.makedirs(targetDir, exist_ok=True)
+    previous = readManifest(targetDir)
+    current = dict()
+
+    for path in listFiles(sourceDir):
+        if path == MANIFEST_FILE:
+            continue
+        srcName = os.path.join(sourceDir, *path.split("/"))
+        dstName = os.path.join(targetDir, *path.split("/"))
+        srcStat = os.stat(srcName)
+        entry = previous.get(path)
+
+        # reuse the hash of source files that were not modified since the last sync
+        if entry is not None and entry["size"] == srcStat.st_size and entry["sourceMtime"] == srcStat.st_mtime_ns:
+            sha = entry["sha256"]
+        else:
+            sha = fileHash(srcName)
+
+        try:
+            dstStat = os.stat(dstName)
+        except OSError:
+            dstStat = None
+        if dstStat is None:
+            unchanged = False
+        elif entry is None:
+            # not synchronized with a manifest before, compare the file content
+            unchanged = dstStat.st_size == srcStat.st_size and fileHash(dstName) == sha
+        else:
+            unchanged = entry["sha256"] == sha and entry["size"] == dstStat.st_size and \
+                entry["targetMtime"] == dstStat.st_mtime_ns
+        if unchanged:
+            report.unchanged.append(path)
+        else:
+            os.makedirs(os.path.dirname(dstName), exist_ok=True)
+            tmpName = dstName + ".tmp"
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            linked = False
+            if link:
+                try:
+                    os.link(srcName, tmpName)
+                    linked = True
+                except OSError:
+                    # e.g. different file systems, copy the file instead
+                    pass
+            if not linked:
+                shutil.copy2(srcName, tmpName)
+            os.replace(tmpName, dstName)
+            dstStat = os.stat(dstName)
+            if linked:
+                report.linked.append(path)
+            else:
+                report.copied.append(path)
+
+        current[path] = {"sha256": sha, "size": srcStat.st_size, "sourceMtime": srcStat.st_mtime_ns,
+                         "targetMtime": dstStat.st_mtime_ns}
+
+    # remove files that were synchronized before, but no longer exist in the source directory
+    for path in sorted(set(previous) - set(current)):
+        dstName = os.path.join(targetDir, *path.split("/"))
+        if os.path.exists(dstName):
+            os.remove(dstName)
+        report.deleted.append(path)
+
+    writeManifest(targetDir, current)
+    return report
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Registry for the parsed input files of a single test case.
+#
+# The result files of the reference tools are needed twice, for building the
+# combined reference results and for scoring the tool itself. The registry
+# parses each file only once and hands the same arrays to both.
+
+import os
+
+from TSVContainer import TSVContainer
+from config import SENTINEL_VALUES
+
+
+class FileRegistry:
+    """
+    Parsed tool result files of a test case, read with TSVContainer.readAsArrays().
+    Files are parsed on first access and kept until they are taken for scoring.
+    With a cacheDir given, parsed files are stored there in binary form and later
+    runs memory-map them instead of parsing the files again.
+    Cells with one of the values in 'sentinels' are marked as invalid, see
+    TSVContainer.readAsArrays().
+    """
+
+    def __init__(self, tsvPath, cacheDir=None, sentinels=SENTINEL_VALUES):
+        self.tsvPath = tsvPath
+        self.cacheDir = cacheDir
+        self.sentinels = sentinels
+        # key is tool result file name, value is tuple (TSVContainer, validNumbers)
+        self.files = dict()
+
+    def __getstate__(self):
+        # parsed data is not passed to worker processes, they parse (or memory-map) the files themselves
+        return {'tsvPath': self.tsvPath, 'cacheDir': self.cacheDir, 'sentinels': self.sentinels, 'files': dict()}
+
+    def __contains__(self, dataFile):
+        """True if the tool result file is already parsed."""
+        return dataFile in self.files
+
+    def get(self, dataFile):
+        """
+        Returns a tuple (TSVContainer, validNumbers) for the tool result file, the file is
+        parsed on first access. The returned container must not be modified.
+        """
+        if dataFile not in self.files:
+            tsv = TSVContainer()
+            validNumbers = tsv.readAsArrays(os.path.join(self.tsvPath, dataFile), self.cacheDir, self.sentinels)
+            self.files[dataFile] = (tsv, validNumbers)
+        return self.files[dataFile]
+
+    def take(self, dataFile):
+        """
+        Returns a tuple (TSVContainer, validNumbers) like get(), but removes the file from the
+        registry. The returned container may be modified.
+        """
+        tsv, validNumbers = self.get(dataFile)
+        del self.files[dataFile]
+        return tsv, validNumbers
+
+
+def indexToolSpecifications(toolData):
+    """
+    Returns a dictionary that maps the ToolID in column 'Tool' of the DataFrame with
+    'ToolSpecifications.tsv' to a dictionary with the values of the tool's row. Tools
+    listed more than once are left out, since their specification is ambiguous.
+    """
+    toolSpecs = dict()
+    duplicates = set()
+    for row in toolData.to_dict('records'):
+        toolID = row['Tool']
+        if toolID in toolSpecs:
+            duplicates.add(toolID)
+        toolSpecs[toolID] = row
+    for toolID in duplicates:
+        del toolSpecs[toolID]
+    return toolSpecs
@@ -8,13 +8,23 @@ import sys
 import argparse
 import glob
 import os
+import io
+import contextlib
+import functools
 import pandas as pd  # Data manipulation and analysis
 import datetime as dt
 from StatisticsFunctions import StatisticsFunctions as sf
+from StatisticsFunctions import ReferenceStatistics
 import plotly
 import numpy
+from concurrent.futures import ProcessPoolExecutor
 
 from TSVContainer import TSVContainer
+from ResultCache import ResultCache, testCaseHash, toolHash
+from TimeAlignment import TimeAlignment, StreamingAlignment
+from StreamingStatistics import NormAccumulator
+from FileRegistry import FileRegistry, indexToolSpecifications
+from config import BATCH_SIZE_LIMIT, STREAMING_SIZE_LIMIT
 from PrintFuncs import *
 
 
@@ -43,6 +53,12 @@ class CaseResults:
         self.DisplayColor = "#ffc120"
         self.Unit = ""
         self.Reference = False
+        # norms that were not calculated, since they are neither weighted nor requested
+        self.skippedNorms = set()
+        # norms that could not be calculated, they keep the initial value
+        self.failedNorms = set(NORMS)
+        # norms used for the score of each evaluation period, None if no score was calculated
+        self.periodNorms = None
 
         self.Data = pd.DataFrame
         self.RefData = pd.DataFrame
@@ -58,324 +74,855 @@ def appendErrorResults(tsvData, testCaseName, toolID, errorCode, variables):
         tsvData.append(cr)
 
 
-def listsEqual(list1, list2):
-    if len(list1) != len(list2):
-        return False
-    for i in range(len(list1)):
-        if list1[i] != list2[i]:
-            return False
-    return True
+def readWeightFactors(path):
+    """
+    Reads 'WeightFactors.tsv' of the test case in 'path' and returns a dictionary with the weight
+    factor of each norm, and the sum of all weight factors except 'Max Difference' in key 'Sum'.
+    """
+    try:
+        weightFactorsTSV = TSVContainer()
+        weightFactorsTSV.readAsStrings(os.path.join(path, "WeightFactors.tsv"))
+    except RuntimeError as e:
+        printError(e)
+        printError(f"At least one weight factor has to be specified in 'WeightFactors.tsv'.")
+        exit(1)
+
+    weightFactors = dict()
+
+    diffFactor = 0
+    for i in range(len(weightFactorsTSV.data[0])):
+        if weightFactorsTSV.data[0][i] == "Max Difference":
+            diffFactor = - float(weightFactorsTSV.data[1][i])
+        weightFactors[weightFactorsTSV.data[0][i]] = float(weightFactorsTSV.data[1][i])
+    weightFactors['Sum'] = diffFactor + sum(map(float, weightFactorsTSV.data[1]))  # convert to int and then sum it up
+    return weightFactors
+
+
+def selectNorms(weightFactors, reportNorms=None):
+    """
+    Returns the names of all norms that have to be calculated: the norms that contribute
+    to the score with the given weight factors and the norms listed in 'reportNorms'.
+    With reportNorms = None all norms are calculated.
+    """
+    if reportNorms is None:
+        return list(NORMS)
+    # the average is part of the score calculation of all weighted norms
+    selected = set(reportNorms)
+    selected.add("Average")
+    for norm, weight in weightFactors.items():
+        # 'Max Difference' enters the score with its limit value, regardless of the weight
+        if norm in NORMS and (weight != 0 or norm == "Max Difference"):
+            selected.add(norm)
+    return [norm for norm in NORMS if norm in selected]
+
+
+@functools.lru_cache(maxsize=16)
+def dateRange(startHours, periods, freq):
+    """
+    Returns the time stamps used for daily and hourly aggregation: 'periods' time stamps
+    with frequency 'freq', starting 'startHours' after the beginning of 2021.
+    The array is cached and shared by all variables, hence it is read-only.
+    """
+    startDate = dt.datetime(2021, 1, 1) + dt.timedelta(hours=startHours)
+    dates = pd.date_range(start=startDate, periods=periods, freq=freq).values.copy()
+    dates.flags.writeable = False
+    return dates
+
+
+def periodRange(timeIndex, start, end):
+    """
+    Returns the row range (first, last + 1) of all time points within start and end
+    of a sorted time index, the same rows as selected by DataFrame.loc[start:end].
+    """
+    return numpy.searchsorted(timeIndex, start, side='left'), numpy.searchsorted(timeIndex, end, side='right')
+
+
+def selectRanges(values, ranges):
+    """
+    Returns the values of all row ranges as one array, for a single range this
+    is a view on the values.
+    """
+    if len(ranges) == 1:
+        return values[ranges[0][0]:ranges[0][1]]
+    return numpy.concatenate([values[first:last] for first, last in ranges])
+
+
+class PeriodPlan:
+    """
+    Evaluation periods of a variable on the reference and tool time columns, see planPeriods().
+    Norms of period i are calculated over the rows of the periods 0 to i.
+    """
+    def __init__(self):
+        self.timeIndexRef = None    # reference time column in hours, or minutes for 'min' time columns
+        self.timeIndexData = None   # tool time column in the same unit
+        self.dates = None           # time stamps of the rows for daily and hourly aggregation
+        self.refRanges = []         # row range of each valid period in the reference time column
+        self.dataRanges = []        # row range of each valid period in the tool time column
+        self.error = None           # why the periods end before the last one, None if all periods are valid
+
+    def periodValid(self, valid, i):
+        """
+        Returns the validity mask of the samples of the periods 0 to i. 'valid' holds the masks of
+        the reference and tool data, each may be None if all values are valid. Returns None if all
+        samples are valid.
+        """
+        if valid is None:
+            return None
+        refValid, dataValid = valid
+        periodValid = None
+        if refValid is not None:
+            periodValid = selectRanges(refValid, self.refRanges[:i + 1])
+        if dataValid is not None:
+            toolValid = selectRanges(dataValid, self.dataRanges[:i + 1])
+            periodValid = toolValid if periodValid is None else periodValid & toolValid
+        if periodValid is None or periodValid.all():
+            return None
+        return periodValid
+
+
+def planPeriods(timeColumnRef, timeColumnData, timeIndicator, starts, ends, length):
+    """
+    Returns the PeriodPlan of the evaluation periods given by the start and end time points
+    'starts' and 'ends' (texts in the unit of the time columns). Both time columns must be sorted
+    and have 'length' entries, otherwise no period is valid. Periods end at the first start or
+    end time point that is not a number.
+    """
+    plan = PeriodPlan()
+    split = 1
+    if timeIndicator == "min":
+        split = 60
+    try:
+        timeIndexData = numpy.asarray(timeColumnData, dtype=float) / split
+        timeIndexRef = numpy.asarray(timeColumnRef, dtype=float) / split
+        if length != len(timeIndexData) or length != len(timeIndexRef):
+            raise ValueError(f"Reference data has {length} values, but time columns "
+                             f"have {len(timeIndexRef)} and {len(timeIndexData)} entries.")
+        if length == 0:
+            raise ValueError("Time column is empty.")
+        # periods are looked up by binary search
+        if numpy.any(numpy.diff(timeIndexData) < 0) or numpy.any(numpy.diff(timeIndexRef) < 0):
+            raise ValueError("Time column is not sorted.")
+        plan.timeIndexRef = timeIndexRef
+        plan.timeIndexData = timeIndexData
+        plan.dates = dateRange(timeIndexData[0], len(timeIndexRef), timeIndicator)
+
+        for i in range(len(starts)):
+            if i >= len(ends):
+                raise ValueError(f"Evaluation period {i + 1} has no end time point.")
+            start = float(starts[i]) / split
+            end = float(ends[i]) / split
+            # We only use data between out start and end point
+            plan.refRanges.append(periodRange(timeIndexRef, start, end))
+            plan.dataRanges.append(periodRange(timeIndexData, start, end))
+    except ValueError as e:
+        plan.error = str(e)
+    return plan
+
+
+def weightedScore(norms, weightFactors):
+    """
+    Returns the weighted score of an evaluation period. 'norms' is a dictionary with the
+    values of all norms, the values may also be NumPy arrays with the norms of many
+    results, then an array with their scores is returned.
+    """
+    sum = 999999
+    if weightFactors['Sum'] > 0:
+        sum = weightFactors['Sum']
+    if 'Max Difference' in weightFactors.keys():
+        if sum == 999999:
+            sum = 1
+        else:
+            sum = sum + 1
+
+    maxDiff = 0
+    if "Max Difference" in weightFactors.keys():
+        maxDiff = 80.0 + \
+                  20.0 * (weightFactors.get('Max Difference', 0) - abs(norms['Max Difference'])) / weightFactors.get('Max Difference', 0)
+
+    return (weightFactors.get('CVRMSE', 0) * (100.0 - abs(norms['CVRMSE'])) +  # in %
+            weightFactors.get('Daily Amplitude CVRMSE', 0) * (
+                    100.0 - abs(norms['Daily Amplitude CVRMSE'])) +  # in %
+            weightFactors.get('MBE', 0) * (100.0 - 100.0 * abs(norms['MBE']) / norms['Average']) +
+            weightFactors.get('RMSEIQR', 0) * (100.0 - abs(norms['RMSEIQR'])) +  # in %
+            weightFactors.get('MSE', 0) * (100.0 - 100 * abs(norms['MSE']) / norms['Average']) +
+            weightFactors.get('NMBE', 0) * (100.0 - abs(norms['NMBE'])) +  # in %
+            weightFactors.get('NRMSE', 0) * (100.0 - abs(norms['NRMSE'])) +  # in %
+            weightFactors.get('RMSE', 0) * (100.0 - 100.0 * abs(norms['RMSE']) / norms['Average']) +
+            weightFactors.get('RMSLE', 0) * (100.0 - abs(norms['RMSLE']) / norms['Average']) +
+            weightFactors.get('R squared', 0) * (norms['R squared']) +  # in %
+            weightFactors.get('std dev', 0) * (100.0 - abs(norms['std dev']) / norms['Average']) +
+            maxDiff) / sum
+
+
+def scoreBadge(score):
+    """Returns the SimQuality badge for the (not yet rounded) score."""
+    # scoring caluclation --> >95% : Gold | >90% : Silver | >80% : Bronze
+    badge = 0
+    if (score >= 90):
+        badge = 1
+    elif (score >= 80):
+        badge = 2
+    return badge
 
 
 def evaluateVariableResults(variable, timeColumnRef, timeColumnData, refData, testData, starts, ends, weightFactors,
-                            timeIndicator):
+                            timeIndicator, alignment=None, alignedData=None, norms=None, referenceStatistics=None,
+                            batchNorms=None, valid=None, meanValues=False, accumulators=None):
     """
 	Performance difference calculation between variable data sets.
 	
 	we use different statistical metrics to perform deep comparisions 
 	of the different datasets.
 	
+	If the time columns differ in length, the data sets are converted to a common time
+	column using 'alignment', a TimeAlignment object for both time columns. 'alignedData'
+	may hold the already converted reference and test data.
+	
+	With a list of norm names in 'norms' only these norms are calculated, see selectNorms().
+	
+	'referenceStatistics' is a dictionary with ReferenceStatistics objects for each variable
+	and period, which is shared by all tools whose time column equals the reference time column.
+	
+	'batchNorms' is a dictionary with the norms of the tool that were already calculated
+	together with other tools by batchEvaluateNorms(), for each (variable, period index).
+	
+	'valid' holds the validity masks of the reference and test data (see TSVContainer.valid),
+	None if all values are valid. Samples with an invalid reference or test value are left
+	out of all norms.
+	
+	'meanValues' is True for interval means ('(mean)' in the header label), they are averaged
+	instead of picked or interpolated if the data is converted to a common time column.
+	
+	'accumulators' holds a NormAccumulator for each evaluation period of a tool result file that
+	was read chunk by chunk (see streamToolFile()), with the tool data at the reference time
+	points. Then 'testData' is None, the norms are calculated from the accumulated sums and
+	the tool data is not part of the results.
 	"""
     printNotification("    {}".format(variable))
     cr = CaseResults()
 
-    pdTime = pd.DataFrame()
-    pdRef = pd.DataFrame()
-    pdData = pd.DataFrame()
-
     cr.RefData = pd.DataFrame()
 
     # initialize all statistical methods in cr.norms
     for key in weightFactors:
         cr.norms[key] = -99
+    if norms is not None:
+        cr.skippedNorms = set(NORMS) - set(norms)
+    cr.failedNorms = set(NORMS) - cr.skippedNorms
 
-    for i in range(len(starts)):
-        start = starts[i]
-        end = ends[i]
+    split = 1
+    if timeIndicator == "min":
+        split = 60
 
-        try:
-            split = 1
-            if timeIndicator == "min":
-                split = 60
+    # the time columns are compared once per tool, so the alignment is usually passed in
+    if alignment is None:
+        alignment = TimeAlignment(timeColumnRef, timeColumnData)
+    converted = False
 
+    try:
+        if accumulators is None:
             tempTimeColumnData = [x / split for x in timeColumnData]
             cr.Data = pd.DataFrame(data=testData, index=tempTimeColumnData, columns=["Data"])
+        else:
+            cr.Data = pd.DataFrame()
 
-        except Exception as e:
-            printError(str(e))
-            raise Exception("Could not convert data to case result object.")
+    except Exception as e:
+        printError(str(e))
+        raise Exception("Could not convert data to case result object.")
 
-        try:
-            # Check if time columns are equal. Some tools cannot produce output in under hourly mannor.
-            # For this we are nice and try to convert our reference results.
-            if not listsEqual(timeColumnData, timeColumnRef):
-                if not numpy.allclose(timeColumnData, timeColumnRef):
-                    printWarning(f"        Mismatching time columns in data set file and reference data set.")
+    # hourly time indexes, periods and data arrays only depend on the time columns, they are set up
+    # in the first period
+    plan = None
+    pdD = None
+    # norms used for the score of each period
+    periodNorms = []
 
-        except Exception as e:
+    for i in range(len(starts)):
+        if pdD is not None:
+            cr.Data = pdD
 
+        # Check if time columns are equal. Some tools cannot produce output in under hourly mannor.
+        # For this we are nice and try to convert our reference results.
+        if alignment.needsConversion and not converted:
             printWarning(f"        Trying to convert reference results for our tool with less time steps.")
 
-            if len(timeColumnData) < len(timeColumnRef):
-                newRefData = []
-
-                for i in range(len(timeColumnData)):
-                    if timeColumnData[i] not in timeColumnRef:
-                        printWarning(f"        Time step of tool data {timeColumnData[i]} was not in reference data.")
+            for message in alignment.messages:
+                printWarning(f"        {message}")
+            if alignment.error:
+                printWarning(f"        {alignment.error}")
+                return cr
+
+            if alignedData is not None:
+                refData, testData = alignedData
+            else:
+                refData, testData = alignment.apply(refData, testData, meanValues)
+            # resampled values may be invalid, even if all original values are valid
+            valid = alignment.applyValid(valid, meanValues)
+            timeColumnRef = alignment.timeColumnRef
+            timeColumnData = alignment.timeColumnData
+            converted = True
+
+        elif alignment.mismatch:
+            printWarning(f"        Mismatching time columns in data set file and reference data set.")
+
+        if plan is None:
+            refData = numpy.asarray(refData, dtype=float)
+            plan = planPeriods(timeColumnRef, timeColumnData, timeIndicator, starts, ends, len(refData))
+            if plan.refRanges and accumulators is None:
+                testData = numpy.asarray(testData, dtype=float)
+                pdD = pd.DataFrame(data=testData, index=plan.timeIndexData, columns=["Data"])
+
+        if i >= len(plan.refRanges):
+            printWarning(plan.error)
+            printWarning(f"        Could not convert given data of file to pandas dataframe.")
+            cr.ErrorCode = -15
+            if i > 0:
+                cr.RefData = pd.DataFrame(data=selectRanges(refData, plan.dataRanges),
+                                          index=selectRanges(plan.timeIndexData, plan.dataRanges), columns=["Data"])
+            return cr
+        # row ranges of all evaluation periods so far, for reference and tool time index
+        refRanges = plan.refRanges[:i + 1]
+        dataRanges = plan.dataRanges[:i + 1]
+
+        # samples with invalid reference or test values are left out
+        periodValid = plan.periodValid(valid, i)
+        if periodValid is not None and i == len(starts) - 1:
+            invalidText = "NaN, sentinel values or values that cannot be resampled" if alignment.resampled else \
+                "NaN or sentinel values"
+            printWarning(f"        {len(periodValid) - numpy.count_nonzero(periodValid)} samples with empty cells, "
+                         f"{invalidText} are not evaluated.")
+
+        # norms of the tools with the reference time column may already be calculated for all tools at once
+        batch = None
+        if batchNorms is not None and alignment.equal and periodValid is None:
+            batch = batchNorms.get((variable, i))
+
+        if batch is not None:
+            results, errors = batch
+        else:
+            # norms are calculated over all evaluation periods so far
+            periodRef = pd.Series(selectRanges(refData, refRanges), name="Data")
+            periodTime = pd.Series(selectRanges(plan.dates, refRanges), name="Date and Time")
+
+            # intermediates of the reference data are calculated once for all tools with the same time column,
+            # unless the validity mask of the tool leaves out samples
+            shareStatistics = referenceStatistics is not None and alignment.equal and periodValid is None
+            refStats = None
+            if shareStatistics:
+                refStats = referenceStatistics.get((variable, i))
+            if refStats is None:
+                refStats = ReferenceStatistics(periodRef, periodTime, periodValid)
+                if shareStatistics:
+                    referenceStatistics[(variable, i)] = refStats
+
+            if accumulators is not None:
+                # sums of the tool data were accumulated for each period while reading the file
+                accumulator = NormAccumulator()
+                for periodAccumulator in accumulators[:i + 1]:
+                    accumulator.merge(periodAccumulator)
+                results, errors = accumulator.norms(refStats, norms)
+            else:
+                periodData = pd.Series(selectRanges(testData, dataRanges), name="Data")
+                results = dict()
+                errors = dict()
+                ####### Daily Amplitude CVRMSE #######
+                if 'Daily Amplitude CVRMSE' not in cr.skippedNorms:
+                    value, error = sf.Calculate_masked_norm(
+                        lambda: sf.function_Daily_Amplitude_CVRMSE(periodRef, periodData, periodTime, refStats,
+                                                                   periodValid))
+                    if error is None:
+                        results['Daily Amplitude CVRMSE'] = value
+                    else:
+                        errors['Daily Amplitude CVRMSE'] = error
+
+                ####### All other norms #######
+                # residuals and reference statistics are computed only once for all norms
+                normResults, normErrors = sf.function_all_norms(periodRef, periodData, periodTime, norms, refStats,
+                                                                periodValid)
+                results.update(normResults)
+                errors.update(normErrors)
+
+        cr.norms.update(results)
+        cr.failedNorms.difference_update(results)
+        for norm in errors:
+            printWarning(f"        {errors[norm]}")
+            printWarning(f"        Cannot calculate {norm} for variable '{variable}'")
 
 
+        # TODO : Wichtung
+        periodNorms.append(dict(cr.norms))
+        if (abs(cr.norms['Average']) < 1e-4):
+            cr.score = 0  # prevent division by zero error
+        else:
+            cr.score = cr.score + weightedScore(cr.norms, weightFactors)
 
-                        return cr
+    cr.RefData = pd.DataFrame(data=selectRanges(refData, dataRanges), index=selectRanges(plan.timeIndexData, dataRanges),
+                              columns=["Data"])
 
-                    index = timeColumnRef.index(timeColumnData[i])
-                    newRefData.append(refData[index])
+    cr.periodNorms = periodNorms
+    cr.score = cr.score / len(starts)  # normation
 
-                # time column data from tool data set is now set for reference data set
-                timeColumnRef = timeColumnData
-                refData = newRefData
+    # now set the final SimQuality Badge
+    cr.simQbadge = scoreBadge(cr.score)
+    # rounded like NumPy does, the score is usually a NumPy float
+    cr.score = max(numpy.round(cr.score, 2), 0)
 
-            elif len(timeColumnData) > len(timeColumnRef):
-                newTestData = []
+    return cr
 
-                # if we have less ref data but with smaller time steps
-                # we need to convert the ref data
-                if len(timeColumnData) < 2:
-                    printWarning(f"        Tool data has less then 2 entries.")
-                    return cr
-                if len(timeColumnRef) < 2:
-                    printWarning(f"        Reference data has less then 2 entries.")
-                    return cr
 
-                stepSizeData = timeColumnData[1] - timeColumnData[0]
-                stepSizeRef = timeColumnRef[1] - timeColumnRef[0]
+class TestCaseData:
+    """
+    Collects all data of a single test case that is shared by the evaluation
+    of the individual tool result files.
+    """
+    def __init__(self):
+        self.path = ""
+        self.tsvPath = ""
+        self.testCaseName = ""
+        self.refData = None         # TSVContainer with 'Reference.tsv'
+        self.evalData = None        # TSVContainer with 'EvaluationPeriods.tsv'
+        self.variables = []         # variable names without unit
+        self.rawVariables = []      # variable header labels of 'Reference.tsv'
+        self.evaluationVariables = []
+        self.referenceDf = None     # combined reference results of all tools in 'References.txt'
+        self.referenceValid = dict()    # validity masks of the columns of referenceDf with invalid values
+        self.references = []
+        self.weightFactors = dict()
+        self.toolData = None        # DataFrame with 'ToolSpecifications.tsv'
+        self.toolSpecs = dict()     # rows of 'ToolSpecifications.tsv' by ToolID
+        self.files = None           # FileRegistry with the parsed tool result files
+        self.norms = None           # names of the norms to calculate, None for all norms
+        self.referenceStatistics = dict()   # ReferenceStatistics for each (variable, period index)
+        self.batchNorms = dict()    # norms calculated by batchEvaluateNorms() for each tool result file
+
+
+def streamToolFile(caseData, dataFile, tsv):
+    """
+    Reads a tool result file chunk by chunk into the TSVContainer 'tsv' and accumulates the sums
+    for the norms of all evaluated variables for each evaluation period, without keeping the tool
+    data in memory. This needs the reference time points to be part of the tool's time column,
+    see StreamingAlignment. Otherwise, and if the file cannot be read this way, None is returned
+    and the file has to be read as a whole.
+
+    Returns a dictionary that maps the header label of each evaluated variable to a tuple
+    (accumulators, valid) with a NormAccumulator for each evaluation period and the validity mask
+    of the tool data at the reference time points, None if all values are valid.
+    """
+    referenceDf = caseData.referenceDf
+    timeHeader = caseData.refData.headers[0]
+
+    chunks = tsv.readChunks(os.path.join(caseData.tsvPath, dataFile), sentinels=caseData.files.sentinels)
+    alignment = None
+    fromHeader = None
+    # for each evaluated variable the column index, the reference data and the PeriodPlan, and the accumulators
+    columns = dict()
+    accumulators = dict()
+    toolValid = dict()
+    try:
+        for values, valid in chunks:
+            if alignment is None:
+                # the time column is converted like for the data in memory
+                if tsv.headers[0] != timeHeader and timeHeader in referenceDf.columns and \
+                        tsv.convertTimes(values[0], tsv.headers[0], timeHeader) is not None:
+                    fromHeader = tsv.headers[0]
+                    tsv.headers[0] = timeHeader
+                if tsv.headers[0] not in referenceDf.columns:
+                    raise ValueError("Missing reference time column '{}'.".format(tsv.headers[0]))
+                timeColumnRef = numpy.asarray(referenceDf[tsv.headers[0]].to_numpy(), dtype=float)
+                alignment = StreamingAlignment(timeColumnRef)
 
-                if stepSizeData > stepSizeRef:
-                    newRefData = []
-                    newTimeColumn = []
+                timeIndicator = tsv.headers[0].split('[')[1].split(']')[0]
 
-                    printWarning(f"        Tool data step size is less then reference data step size and contains more data then reference. Converting reference data.")
+                for variable, rawVariable in zip(caseData.variables, caseData.rawVariables):
+                    if variable not in caseData.evaluationVariables or rawVariable not in tsv.headers or \
+                            rawVariable not in referenceDf.columns:
+                        continue
+                    # same periods as in evaluateVariableResults(), evaluation stops at the first invalid period
+                    j = caseData.evaluationVariables.index(variable)
+                    plan = planPeriods(timeColumnRef, timeColumnRef, timeIndicator,
+                                       caseData.evalData.data[1][j].split(","),
+                                       caseData.evalData.data[2][j].split(","), len(timeColumnRef))
+                    columns[rawVariable] = (tsv.headers.index(rawVariable),
+                                            numpy.asarray(referenceDf[rawVariable].to_numpy(), dtype=float), plan)
+                    accumulators[rawVariable] = [NormAccumulator() for r in plan.refRanges]
+                    toolValid[rawVariable] = None
+
+            times = values[0]
+            if fromHeader is not None:
+                times = tsv.convertTimes(times, fromHeader, timeHeader)
+            if alignment.dataLength == 0 and caseData.testCaseName != "09-Verschattung" and \
+                    numpy.all(numpy.abs(numpy.fmod(times, 1)) == 0.5):
+                raise ValueError("Data file may need to be interpolated.")
+            dataRows, refRows = alignment.match(times)
+            if len(dataRows) < len(times) and any("(mean)" in rawVariable for rawVariable in columns):
+                raise ValueError("Interval means need to be averaged.")
+
+            for rawVariable, (colIdx, refData, plan) in columns.items():
+                testData = values[colIdx][dataRows]
+                # samples with invalid reference or test values are left out
+                rowValid = None
+                if valid[colIdx] is not None:
+                    rowValid = valid[colIdx][dataRows]
+                    if toolValid[rawVariable] is None and not rowValid.all():
+                        toolValid[rawVariable] = numpy.ones(len(refData), dtype=bool)
+                    if toolValid[rawVariable] is not None:
+                        toolValid[rawVariable][refRows] = rowValid
+                refValid = caseData.referenceValid.get(rawVariable)
+                if refValid is not None:
+                    rowValid = refValid[refRows] if rowValid is None else rowValid & refValid[refRows]
+
+                for (first, last), accumulator in zip(plan.refRanges, accumulators[rawVariable]):
+                    lower, upper = numpy.searchsorted(refRows, [first, last], side='left')
+                    selected = numpy.arange(lower, upper)
+                    if rowValid is not None:
+                        selected = selected[rowValid[lower:upper]]
+                    accumulator.update(refData[refRows[selected]], testData[selected], plan.dates[refRows[selected]])
+        if alignment is not None:
+            alignment.finish()
+    except (RuntimeError, ValueError) as e:
+        chunks.close()
+        printNotification("    {} Reading the whole file.".format(e))
+        return None
 
-                    for i in range(len(timeColumnData)):
-                        if timeColumnData[i] < timeColumnRef[0] or timeColumnData[i] > timeColumnRef[-1]:
-                            continue    # we do not have reference data for all tool data time steps, so we skip all
-                                        # data that is not included
+    if fromHeader is not None:
+        printNotification(f"    Time column '{fromHeader}' converted to '{timeHeader}'.")
+    return {rawVariable: (accumulators[rawVariable], toolValid[rawVariable]) for rawVariable in columns}
 
-                        if timeColumnData[i] not in timeColumnRef:
-                            printWarning(f"        Could not find tool data time step {timeColumnData[i]} in time column of reference data. ")
-                            return cr
 
-                        indexRef = timeColumnRef.index(timeColumnData[i])
-                        newRefData.append(refData[indexRef])
+def processToolFile(caseData, dataFile):
+    """
+    Reads the result file of a single tool and evaluates all variables against
+    the reference results.
 
-                        indexData = timeColumnData.index(timeColumnData[i])
-                        newTestData.append(testData[indexData])
+    Returns a list of CaseResults objects, one for each variable.
+    """
+    path = caseData.path
+    tsvPath = caseData.tsvPath
+    testCaseName = caseData.testCaseName
+    refData = caseData.refData
+    evalData = caseData.evalData
+    variables = caseData.variables
+    rawVariables = caseData.rawVariables
+    evaluationVariables = caseData.evaluationVariables
+    referenceDf = caseData.referenceDf
+    references = caseData.references
+    weightFactors = caseData.weightFactors
+    toolData = caseData.toolData
 
-                        newTimeColumn.append(timeColumnData[i])
+    tsvData = []
+    printNotification("\n-------------------------------------------------------\n")
+    printNotification("Reading '{}'.".format(dataFile))
+    toolID = dataFile[0:-4]  # strip tsv
+    # large files are scored while they are read, unless they are already parsed
+    streamed = None
+    if dataFile not in caseData.files and os.path.getsize(os.path.join(tsvPath, dataFile)) > STREAMING_SIZE_LIMIT:
+        tsv = TSVContainer()
+        validNumbers = True
+        streamed = streamToolFile(caseData, dataFile, tsv)
+    if streamed is None:
+        tsv, validNumbers = caseData.files.take(dataFile)
+    else:
+        printNotification("    Data file read chunk by chunk, its data is not exported to the dashboard.")
+    if True in tsv.emptyColumn:
+        printError("    '{}' contains empty columns. Skipped.".format(dataFile))
+        appendErrorResults(tsvData, testCaseName, toolID, -10, variables)
+        return tsvData
+
+    # the time column may be given in another unit than in the reference results, e.g. in minutes
+    timeHeader = refData.headers[0]
+    if streamed is None and tsv.headers[0] != timeHeader and timeHeader in referenceDf.columns:
+        fromHeader = tsv.headers[0]
+        if tsv.convertTimeUnit(timeHeader):
+            printNotification(f"    Time column '{fromHeader}' converted to '{timeHeader}'.")
+
+    # if not all data is provieded by a tool we only want to skip the specific variable
+    for header in tsv.headers:
+        if header not in refData.headers:
+            printError(f"    '{dataFile}'s header '{header}' is not part of the reference header. Skipped.")
+            continue
 
+    # Check if only valid numbers are in file
+    if not validNumbers:
+        printError("    Data file contains invalid numbers. Skipped.")
+        appendErrorResults(tsvData, testCaseName, toolID, -7, variables)
+        return tsvData
+
+    # check if we have to interpolate half hourly data
+    if streamed is None and testCaseName != "09-Verschattung":
+        if tsv.interpolateHalfHourlyData():
+            printNotification("    Data file needs to be interpolated.")
+
+    # all variables share the time column, so the time columns are aligned only once
+    alignment = None
+
+    # process all variables
+    for i in range(len(variables)):
+        doCalculation = True
+
+        # call function to generate and evaluate all norms for the given variable
+        # we provide time column, reference data column and value column, also parameter set for norm calculation
+        # we get a variable-specific score stored in CaseResults object
+        if not rawVariables[i] in tsv.headers:
+            printError("    '{}'s does not contain the variable {}.".format(dataFile, variables[i]))
+            cr = CaseResults()
+            cr.simQbadge = 99
+            cr.score = -99
+            doCalculation = False
+
+        # check if data even exists
+        # if i > len(tsv.data):
+        #     printError("    '{}'s columns exceed number of columns of 'Reference.tsv'".format(dataFile))
+        #     appendErrorResults(tsvData, testCaseName, toolID, -11, variables)
+        #     break
+
+        if not variables[i] in evaluationVariables:
+            printError(
+                "    'EvaluationPeriods.tsv' does not contain the variable '{}'. Skipped.".format(variables[i]))
+            continue
 
-                    timeColumnRef = newTimeColumn
-                    timeColumnData = newTimeColumn
+        if doCalculation and not rawVariables[i] in referenceDf.columns:
+            printError("    Reference results do not contain the variable '{}'. Skipped.".format(variables[i]))
+            continue
 
-                    testData = newTestData
-                    refData = newRefData
+        for j in range(len(evaluationVariables)):
+            if variables[i] == evaluationVariables[j]:
+                starts = evalData.data[1][j].split(",")
+                ends = evalData.data[2][j].split(",")
+                break
 
-                else:
-                    for i in range(len(timeColumnRef)):
-                        if timeColumnRef[i] not in timeColumnData:
-                            printWarning(f"        Could not find reference data time step {timeColumnRef[i]} in time column of tool data. ")
-                            return cr
+        if len(starts) != len(ends):
+            printError(
+                f"    Start and end timpoints for evaluation do not have the same size: {len(start)} vs {len(end)}")
 
-                        index = timeColumnData.index(timeColumnRef[i])
-                        newTestData.append(testData[index])
+        for j in range(len(starts)):
+            start = float(starts[j])
+            end = float(ends[j])
+            if end < start:
+                printError(
+                    "    Evaluation End Point ({}) has to be after start point ({}). Skipped.".format(end, start))
+                continue
 
-                    # time column data from tool data set is now set for reference data set
-                    timeColumnData = timeColumnRef
-                    testData = newTestData
+            if end > refData.data[0][-1]:
+                printError(
+                    "    Evaluation End Point ({}) is bigger then last time stamp of reference results ({}). Skipped.".format(
+                        end, refData.data[0][-1]))
+                continue
+            if start < refData.data[0][0]:
+                printError(
+                    "    Evaluation Start Point ({}) is smaller then first time stamp of reference results ({}). Skipped.".format(
+                        end, refData.data[0][0]))
+                continue
 
-        # We first convert our data to pandas
+        # check if have an hourly time column
         try:
-            split = 1
-            if timeIndicator == "min":
-                split = 60
-
-            # Convert all the data to hourly indexes
-            start = float(start) / split
-            end = float(end) / split
-
-            tempTimeColumnData = [x / split for x in timeColumnData]
-            tempTimeColumnRef = [x / split for x in timeColumnRef]
-
-            startDate = dt.datetime(2021, 1, 1) + dt.timedelta(hours=tempTimeColumnData[0])
-            pdT = pd.DataFrame(data=pd.date_range(start=startDate, periods=len(tempTimeColumnRef), freq=timeIndicator),
-                               index=tempTimeColumnRef, columns=["Date and Time"])
-            pdD = pd.DataFrame(data=testData, index=tempTimeColumnData, columns=["Data"])
-            pdR = pd.DataFrame(data=refData, index=tempTimeColumnRef, columns=["Data"])
-
-            # cr.Data = pd.DataFrame(data=testData, index=tempTimeColumnData, columns=["Data"])
-            cr.RefData = pd.concat([cr.RefData,
-                                    pd.DataFrame(data=refData, index=tempTimeColumnData,
-                                                 columns=["Data"]).loc[start:end]])
-
-        except ValueError as e:
-            printWarning(str(e))
-            printWarning(f"        Could not convert given data of file to pandas dataframe.")
-            cr.ErrorCode = -15
-            return cr
-
-        # We only use data between out start and end point
-        pdTime = pd.concat([pdTime, pdT.loc[start:end]])
-        pdData = pd.concat([pdData, pdD.loc[start:end]])
-        pdRef = pd.concat([pdRef, pdR.loc[start:end]])
+            timeIndicator = tsv.headers[0].split('[')[1].split(']')[0]
+        except Exception as e:
+            printError(str(e))
+            raise Exception(f"Could not convert time unit {tsv.headers[0]} to h.")
+
+        if doCalculation:
+            cols = referenceDf.columns
+            time = cols[0]
+            data = cols[i + 1]
+
+            # if data has not the same order we look for the correct header position
+            # and take its index
+            indexData = tsv.headers.index(rawVariables[i])
+            # indexRef = list(referenceDf.columns).index(rawVariables[i])
+
+            # time columns are passed as lists, they are compared and aligned only once and
+            # all value columns are converted together as 2-D arrays
+            if streamed is not None:
+                # the tool data was accumulated at the reference time points while reading the file
+                if alignment is None:
+                    timeColumnRef = referenceDf[tsv.headers[0]].tolist()
+                    alignment = TimeAlignment(timeColumnRef, timeColumnRef)
+                accumulators, toolValid = streamed[rawVariables[i]]
+                refValid = caseData.referenceValid.get(rawVariables[i])
+                valid = None
+                if refValid is not None or toolValid is not None:
+                    valid = (numpy.ones(len(timeColumnRef), dtype=bool) if refValid is None else refValid,
+                             numpy.ones(len(timeColumnRef), dtype=bool) if toolValid is None else toolValid)
+                cr = evaluateVariableResults(variables[i], timeColumnRef, timeColumnRef,
+                                             referenceDf[rawVariables[i]].to_numpy(), None, starts, ends,
+                                             weightFactors, timeIndicator, alignment, None, caseData.norms,
+                                             caseData.referenceStatistics, None, valid,
+                                             accumulators=accumulators)
+            else:
+                if alignment is None:
+                    timeColumnRef = referenceDf[tsv.headers[0]].tolist()
+                    timeColumnData = numpy.asarray(tsv.data[0]).tolist()
+                    alignment = TimeAlignment(timeColumnRef, timeColumnData)
+                    # only evaluated variables that are part of the tool and of the reference results
+                    columns = [v for v, variable in zip(rawVariables, variables)
+                               if variable in evaluationVariables and v in tsv.headers and v in referenceDf.columns]
+                    meanColumns = ["(mean)" in v for v in columns]
+                    refColumns = referenceDf[columns].to_numpy()
+                    toolColumns = numpy.column_stack([tsv.data[tsv.headers.index(v)] for v in columns])
+                    alignedRef, alignedTool = alignment.apply(refColumns, toolColumns, meanColumns)
+                    refValid = [caseData.referenceValid.get(v) for v in columns]
+                    toolValid = [tsv.valid[tsv.headers.index(v)] for v in columns]
+
+                k = columns.index(rawVariables[i])
+                valid = None
+                if refValid[k] is not None or toolValid[k] is not None:
+                    valid = (numpy.ones(len(refColumns), dtype=bool) if refValid[k] is None else refValid[k],
+                             numpy.ones(len(toolColumns), dtype=bool) if toolValid[k] is None else toolValid[k])
+                cr = evaluateVariableResults(variables[i], timeColumnRef, timeColumnData,
+                                             refColumns[:, k], toolColumns[:, k], starts, ends,
+                                             weightFactors, timeIndicator, alignment,
+                                             (alignedRef[:, k], alignedTool[:, k]), caseData.norms,
+                                             caseData.referenceStatistics, caseData.batchNorms.get(dataFile), valid,
+                                             meanColumns[k])
+        cr.TestCase = testCaseName
+        cr.ToolID = toolID
+        cr.Variable = variables[i]
+        cr.ErrorCode = 0
+        cr.Unit = rawVariables[i].split("[")[1].split("]")[0].strip()
+
+        if toolID in references:
+            cr.Reference = True
 
-        ####### MAXIMUM #######
-        try:
-            # we evaluate the results
-            cr.norms['Maximum'] = sf.function_Maximum(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate Maximum for variable '{variable}'")
-        ####### MINUMUM #######
-        try:
-            cr.norms['Minimum'] = sf.function_Minimum(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate Minimum for variable '{variable}'")
-        ####### Average #######
-        try:
-            cr.norms['Average'] = sf.function_Average(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate Average for variable '{variable}'")
-        ####### CVRMSE #######
-        try:
-            cr.norms['CVRMSE'] = sf.function_CVRMSE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate CVRMSE for variable '{variable}'")
-        ####### Daily Amplitude CVRMSE #######
         try:
-            cr.norms['Daily Amplitude CVRMSE'] = sf.function_Daily_Amplitude_CVRMSE(pdRef["Data"], pdData["Data"],
-                                                                                    pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate Daily Amplitude CVRMSE for variable '{variable}'")
-        ####### MBE #######
-        try:
-            cr.norms['MBE'] = sf.function_MBE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate MBE for variable '{variable}'")
+            data = caseData.toolSpecs[toolID]
+            cr.DisplayName = data['Tool Name']
+            cr.Version = data['Tool Version']
+            cr.Editor = data['Tool Editor']
+            cr.DisplayColor = data['Tool Color']
+        except Exception as e:
+            printError(str(e))
+            raise Exception(f"Data in 'ToolSpecifications.tsv' in {path} not specified for Tool '{toolID}'")
 
-        try:
-            cr.norms['RMSEIQR'] = sf.function_RMSEIQR(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate RMSIQR for variable '{variable}'")
+        tsvData.append(cr)
 
-        try:
-            cr.norms['MSE'] = sf.function_MSE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate MSE for variable '{variable}'")
+    return tsvData
 
-        try:
-            cr.norms['NMBE'] = sf.function_NMBE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printNotification(f"        Cannot calculate NMBE for variable '{variable}'")
 
-        try:
-            cr.norms['NRMSE'] = sf.function_NRMSE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate NRMSE for variable '{variable}'")
+def processToolFileCaptured(caseData, dataFile):
+    """
+    Same as processToolFile(), but captures the console output instead of printing it,
+    so that logs of concurrently processed tools do not interleave.
 
-        try:
-            cr.norms['RMSE'] = sf.function_RMSE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate RMSE for variable '{variable}'")
+    Returns a tuple with the list of CaseResults objects and the captured log.
+    """
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            tsvData = processToolFile(caseData, dataFile)
+    except Exception:
+        # keep the log that leads to the error
+        print(log.getvalue(), end="")
+        raise
+    return tsvData, log.getvalue()
 
-        try:
-            cr.norms['RMSLE'] = sf.function_RMSLE(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate RMSLE for variable '{variable}'")
 
-        try:
-            cr.norms['R squared'] = sf.function_R_squared_coeff_determination(pdRef["Data"],pdData["Data"],pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate R squared for variable '{variable}'")
+def batchEvaluateNorms(caseData, dataFiles):
+    """
+    Calculates the norms of all tools whose time column equals the time column of the
+    reference results together, with one batched calculation for each variable and
+    evaluation period. Tools that need their data to be interpolated or aligned are left
+    out, they are evaluated on their own, and so are periods with invalid values.
 
-        try:
-            cr.norms['std dev'] = sf.function_std_dev(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate std dev for variable '{variable}'")
+    All tool result files stay parsed until their tool is evaluated. If the files are larger
+    than BATCH_SIZE_LIMIT in total, nothing is calculated, so that each file is only parsed
+    when its tool is evaluated.
 
-        try:
-            cr.norms['Max Difference'] = sf.function_max_difference(pdRef["Data"], pdData["Data"], pdTime["Date and Time"])
-        except (RuntimeError, RuntimeWarning) as e:
-            printWarning(f"        {str(e)}")
-            printWarning(f"        Cannot calculate Max Difference for variable '{variable}'")
+    Returns a dictionary that maps the tool result file to a dictionary with the tuple
+    (results, errors) for each (variable, period index), see evaluateVariableResults().
+    """
+    referenceDf = caseData.referenceDf
+
+    totalSize = sum(os.path.getsize(os.path.join(caseData.tsvPath, dataFile)) for dataFile in dataFiles)
+    if totalSize > BATCH_SIZE_LIMIT:
+        printNotification("    Tool result files are too large ({} MB) to calculate the norms of all tools "
+                          "together.".format(totalSize // (1024 * 1024)))
+        return dict()
+
+    # tools with the time column of the reference results, grouped by time column header
+    groups = dict()
+    for dataFile in dataFiles:
+        tsv, validNumbers = caseData.files.get(dataFile)
+        if not validNumbers or True in tsv.emptyColumn:
+            continue
+        if caseData.testCaseName != "09-Verschattung" and tsv.isHalfHourly():
+            continue
+        timeHeader = tsv.headers[0]
+        if timeHeader not in referenceDf.columns or '[' not in timeHeader:
+            continue
+        if not numpy.array_equal(numpy.asarray(tsv.data[0]), referenceDf[timeHeader].to_numpy()):
+            continue
+        groups.setdefault(timeHeader, []).append((dataFile, tsv))
 
+    batchNorms = dict()
+    for timeHeader, tools in groups.items():
+        if len(tools) < 2:
+            continue
+        timeIndicator = timeHeader.split('[')[1].split(']')[0]
+        timeColumnRef = referenceDf[timeHeader].to_numpy()
 
-        # TODO : Wichtung
-        if (abs(cr.norms['Average']) < 1e-4):
-            cr.score = 0  # prevent division by zero error
-        else:
-            sum = 999999
-            if weightFactors['Sum'] > 0:
-                sum = weightFactors['Sum']
-            if 'Max Difference' in weightFactors.keys():
-                if sum == 999999:
-                    sum = 1
-                else:
-                    sum = sum + 1
-
-            maxDiff = 0
-            if "Max Difference" in weightFactors.keys():
-                maxDiff = 80.0 + \
-                          20.0 * (weightFactors.get('Max Difference', 0) - abs(cr.norms['Max Difference'])) / weightFactors.get('Max Difference', 0)
-
-            cr.score = cr.score + \
-                       (weightFactors.get('CVRMSE', 0) * (100.0 - abs(cr.norms['CVRMSE'])) +  # in %
-                        weightFactors.get('Daily Amplitude CVRMSE', 0) * (
-                                100.0 - abs(cr.norms['Daily Amplitude CVRMSE'])) +  # in %
-                        weightFactors.get('MBE', 0) * (100.0 - 100.0 * abs(cr.norms['MBE']) / cr.norms['Average']) +
-                        weightFactors.get('RMSEIQR', 0) * (100.0 - abs(cr.norms['RMSEIQR'])) +  # in %
-                        weightFactors.get('MSE', 0) * (100.0 - 100 * abs(cr.norms['MSE']) / cr.norms['Average']) +
-                        weightFactors.get('NMBE', 0) * (100.0 - abs(cr.norms['NMBE'])) +  # in %
-                        weightFactors.get('NRMSE', 0) * (100.0 - abs(cr.norms['NRMSE'])) +  # in %
-                        weightFactors.get('RMSE', 0) * (100.0 - 100.0 * abs(cr.norms['RMSE']) / cr.norms['Average']) +
-                        weightFactors.get('RMSLE', 0) * (100.0 - abs(cr.norms['RMSLE']) / cr.norms['Average']) +
-                        weightFactors.get('R squared', 0) * (cr.norms['R squared']) +  # in %
-                        weightFactors.get('std dev', 0) * (100.0 - abs(cr.norms['std dev']) / cr.norms['Average']) +
-                        maxDiff) / sum
+        for variable, rawVariable in zip(caseData.variables, caseData.rawVariables):
+            if variable not in caseData.evaluationVariables or rawVariable not in referenceDf.columns:
+                continue
+            j = caseData.evaluationVariables.index(variable)
+            starts = caseData.evalData.data[1][j].split(",")
+            ends = caseData.evalData.data[2][j].split(",")
+            variableTools = [(dataFile, tsv.data[tsv.headers.index(rawVariable)],
+                              tsv.valid[tsv.headers.index(rawVariable)])
+                             for dataFile, tsv in tools if rawVariable in tsv.headers]
+            if len(variableTools) < 2:
+                continue
+            refValid = caseData.referenceValid.get(rawVariable)
 
-    cr.score = cr.score / len(starts)  # normation
+            refData = numpy.asarray(referenceDf[rawVariable].to_numpy(), dtype=float)
+            toolData = numpy.stack([numpy.asarray(data, dtype=float) for dataFile, data, valid in variableTools])
+            # same periods as in evaluateVariableResults(), evaluation stops at the first invalid period
+            plan = planPeriods(timeColumnRef, timeColumnRef, timeIndicator, starts, ends, len(timeColumnRef))
+            ranges = plan.refRanges
 
-    # scoring caluclation --> >95% : Gold | >90% : Silver | >80% : Bronze
-    badge = 0
-    if (cr.score >= 90):
-        badge = 1
-    elif (cr.score >= 80):
-        badge = 2
-    # now set the final SimQuality Badge
-    cr.simQbadge = badge
-    cr.score = max(round(cr.score, 2), 0)
+            for i in range(len(ranges)):
+                # periods with invalid values are evaluated with the validity masks, for each tool on its own
+                if plan.periodValid((refValid, None), i) is not None:
+                    continue
+                members = [k for k, (dataFile, data, valid) in enumerate(variableTools)
+                           if plan.periodValid((None, valid), i) is None]
+                if not members:
+                    continue
+                refStats = caseData.referenceStatistics.get((variable, i))
+                if refStats is None:
+                    refStats = ReferenceStatistics(pd.Series(selectRanges(refData, ranges[:i + 1]), name="Data"),
+                                                   pd.Series(selectRanges(plan.dates, ranges[:i + 1]),
+                                                             name="Date and Time"))
+                    caseData.referenceStatistics[(variable, i)] = refStats
+                periodData = numpy.concatenate([toolData[members, first:last] for first, last in ranges[:i + 1]],
+                                               axis=1)
+                batch = sf.function_batch_norms(refStats, periodData, caseData.norms)
+                if batch is None:
+                    continue
+                for k, norms in zip(members, batch):
+                    batchNorms.setdefault(variableTools[k][0], dict())[(variable, i)] = norms
 
-    return cr
+    if batchNorms:
+        printNotification("    Norms of {} tools calculated together.".format(len(batchNorms)))
+    return batchNorms
 
 
 # all the data is stored in a dictionary with tool-specific data
-def processDirectory(path):
+def processDirectory(path, jobs=1, cacheDir=None, reportNorms=None):
     """
 	Processes a test case directory, i.e. path = "data/TF03-Waermeleitung".
 	It then reads data from the subdirectory 'Auswertung/Ergebnisse' and
 	calculates the validation score.
 	
+	With jobs > 1 the tool result files are evaluated concurrently in a pool
+	of worker processes.
+	
+	With a cacheDir given, results are read from and stored in a persistent
+	result cache. Only tools whose input files have changed are evaluated.
+	Parsed tool result files are cached in binary form in the same directory.
+	
+	Norms that do not contribute to the score are only calculated if listed in
+	reportNorms. With reportNorms = None all norms are calculated.
+	
 	Returns a CaseResults object with data for all test variables. 
 	'None' indicates entirely invalid/missing test data or reference data.
 	"""
@@ -401,6 +948,26 @@ def processDirectory(path):
         return None
     tsvFiles = sorted(tsvFiles)
 
+    # special handling of reference data files needed only for visualization
+    toolFiles = [f for f in tsvFiles if not f.startswith("Reference") and not f.startswith("EvaluationPeriods")]
+
+    # look up cached results, only tools with changed input files need to be evaluated
+    cache = None
+    toolKeys = dict()
+    cachedResults = dict()
+    if cacheDir is not None:
+        cache = ResultCache(cacheDir, os.path.split(path)[1])
+        cache.load()
+        caseKey = testCaseHash(path, tsvPath, reportNorms)
+        for dataFile in toolFiles:
+            toolKeys[dataFile] = toolHash(caseKey, os.path.join(tsvPath, dataFile))
+            results = cache.get(dataFile, toolKeys[dataFile])
+            if results is not None:
+                cachedResults[dataFile] = results
+        if len(toolFiles) > 0 and len(cachedResults) == len(toolFiles):
+            printNotification("    Input files unchanged, all results taken from result cache.")
+            return [cr for dataFile in toolFiles for cr in cachedResults[dataFile]]
+
     # read evaluation periods
     evalData = TSVContainer()
     evalData.readAsStrings(os.path.join(path, "EvaluationPeriods.tsv"))
@@ -410,11 +977,11 @@ def processDirectory(path):
 
     # read reference file
     refData = TSVContainer()
-    refData.readAsStrings(os.path.join(path, "Reference.tsv"))
+    validNumbers = refData.readAsArrays(os.path.join(path, "Reference.tsv"))
     if True in refData.emptyColumn:
         printError("    'Reference.tsv' contains empty columns.")
         return None
-    if not refData.convert2Double():
+    if not validNumbers:
         printError("    'Reference.tsv' contains invalid numbers.")
         return None
 
@@ -428,22 +995,7 @@ def processDirectory(path):
         printError(f"References.txt needs to be specified. Separated by ','")
 
     # read Weight factors
-    try:
-        weightFactorsTSV = TSVContainer()
-        weightFactorsTSV.readAsStrings(os.path.join(path, "WeightFactors.tsv"))
-    except RuntimeError as e:
-        printError(e)
-        printError(f"At least one weight factor has to be specified in 'WeightFactors.tsv'.")
-        exit(1)
-
-    weightFactors = dict()
-
-    diffFactor = 0
-    for i in range(len(weightFactorsTSV.data[0])):
-        if weightFactorsTSV.data[0][i] == "Max Difference":
-            diffFactor = - float(weightFactorsTSV.data[1][i])
-        weightFactors[weightFactorsTSV.data[0][i]] = float(weightFactorsTSV.data[1][i])
-    weightFactors['Sum'] = diffFactor + sum(map(float, weightFactorsTSV.data[1]))  # convert to int and then sum it up
+    weightFactors = readWeightFactors(path)
 
     # read Weight factors
     ToolData = []
@@ -484,7 +1036,14 @@ def processDirectory(path):
 
     referenceDf = pd.DataFrame()
 
+    # tool result files are parsed only once, for the references and for scoring
+    parseCacheDir = None
+    if cacheDir is not None:
+        parseCacheDir = os.path.join(cacheDir, os.path.split(path)[1])
+    files = FileRegistry(tsvPath, parseCacheDir)
+
     tsvData = []
+    referenceTsvs = []
     for dataFile in tsvFiles:
         toolID = dataFile[0:-4]  # strip tsv
         if not toolID in references:
@@ -494,147 +1053,78 @@ def processDirectory(path):
         printNotification("Generating References.\n")
         printNotification("Reading '{}'.".format(dataFile))
 
-        df = pd.read_csv(os.path.join(tsvPath, dataFile), sep="\t", on_bad_lines='warn')
+        tsv, validNumbers = files.get(dataFile)
+        if not validNumbers:
+            printError("    Reference results '{}' contain invalid numbers.".format(dataFile))
+            return None
+
+        df = pd.DataFrame(dict(zip(tsv.headers, tsv.data)))
         df = df.reindex(sorted(df.columns), axis=1) # resort by column
 
         referenceDf = referenceDf.add(df, fill_value=0)
+        referenceTsvs.append(tsv)
 
 
     ###############################################################
 
     referenceDf = referenceDf.div(len(references))
 
-    # now read in all the reference files, collect the variable headers and write out the collective file
-    tsvData = []
-    for dataFile in tsvFiles:
-
-        # special handling of reference data files needed only for visualization
-        if dataFile.startswith("Reference"):
-            continue
-
-        if dataFile.startswith("EvaluationPeriods"):
-            continue
-
-        printNotification("\n-------------------------------------------------------\n")
-        printNotification("Reading '{}'.".format(dataFile))
-        toolID = dataFile[0:-4]  # strip tsv
-        tsv = TSVContainer()
-        tsv.readAsStrings(os.path.join(tsvPath, dataFile))
-        if True in tsv.emptyColumn:
-            printError("    '{}' contains empty columns. Skipped.".format(dataFile))
-            appendErrorResults(tsvData, testCaseName, toolID, -10, variables)
-            continue
-
-        # if not all data is provieded by a tool we only want to skip the specific variable
-        for header in tsv.headers:
-            if header not in refData.headers:
-                printError(f"    '{dataFile}'s header '{header}' is not part of the reference header. Skipped.")
+    # reference values are invalid if the value of any reference tool is invalid
+    referenceValid = dict()
+    for tsv in referenceTsvs:
+        for header, valid in zip(tsv.headers, tsv.valid):
+            if valid is None:
                 continue
+            mask = referenceValid.setdefault(header, numpy.ones(len(referenceDf), dtype=bool))
+            mask[:len(valid)] &= valid
+
+    # collect all data that is shared by the evaluation of the individual tool files
+    caseData = TestCaseData()
+    caseData.path = path
+    caseData.tsvPath = tsvPath
+    caseData.testCaseName = testCaseName
+    caseData.refData = refData
+    caseData.evalData = evalData
+    caseData.variables = variables
+    caseData.rawVariables = rawVariables
+    caseData.evaluationVariables = evaluationVariables
+    caseData.referenceDf = referenceDf
+    caseData.referenceValid = referenceValid
+    caseData.references = references
+    caseData.weightFactors = weightFactors
+    caseData.toolData = toolData
+    caseData.toolSpecs = indexToolSpecifications(toolData)
+    caseData.files = files
+    caseData.norms = selectNorms(weightFactors, reportNorms)
+
+    pendingFiles = [f for f in toolFiles if f not in cachedResults]
+
+    toolResults = dict()
+    if jobs <= 1:
+        # worker processes parse the tool files themselves, so the batched norms are only used in serial runs
+        caseData.batchNorms = batchEvaluateNorms(caseData, pendingFiles)
+        for dataFile in pendingFiles:
+            toolResults[dataFile] = processToolFile(caseData, dataFile)
+    else:
+        # tool files are evaluated concurrently, results and logs are collected in sorted file order
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(processToolFileCaptured, caseData, dataFile) for dataFile in pendingFiles]
+            for dataFile, future in zip(pendingFiles, futures):
+                toolResults[dataFile], log = future.result()
+                print(log, end="")
 
-        # Check if only valid numbers are in file
-        if not tsv.convert2Double():
-            printError("    Data file contains invalid numbers. Skipped.")
-            appendErrorResults(tsvData, testCaseName, toolID, -7, variables)
-            continue
-
-        # check if we have to interpolate half hourly data
-        if testCaseName != "09-Verschattung":
-            if tsv.interpolateHalfHourlyData():
-                printNotification("    Data file needs to be interpolated.")
-
-        # process all variables
-        for i in range(len(variables)):
-            doCalculation = True
-
-            # call function to generate and evaluate all norms for the given variable
-            # we provide time column, reference data column and value column, also parameter set for norm calculation
-            # we get a variable-specific score stored in CaseResults object
-            if not rawVariables[i] in tsv.headers:
-                printError("    '{}'s does not contain the variable {}.".format(dataFile, variables[i]))
-                cr = CaseResults()
-                cr.simQbadge = 99
-                cr.score = -99
-                doCalculation = False
-
-            # check if data even exists
-            # if i > len(tsv.data):
-            #     printError("    '{}'s columns exceed number of columns of 'Reference.tsv'".format(dataFile))
-            #     appendErrorResults(tsvData, testCaseName, toolID, -11, variables)
-            #     break
-
-            if not variables[i] in evaluationVariables:
-                printError(
-                    "    'EvaluationPeriods.tsv' does not contain the variable '{}'. Skipped.".format(variables[i]))
-                continue
-
-            for j in range(len(evaluationVariables)):
-                if variables[i] == evaluationVariables[j]:
-                    starts = evalData.data[1][j].split(",")
-                    ends = evalData.data[2][j].split(",")
-                    break
-
-            if len(starts) != len(ends):
-                printError(
-                    f"    Start and end timpoints for evaluation do not have the same size: {len(start)} vs {len(end)}")
-
-            for j in range(len(starts)):
-                start = float(starts[j])
-                end = float(ends[j])
-                if end < start:
-                    printError(
-                        "    Evaluation End Point ({}) has to be after start point ({}). Skipped.".format(end, start))
-                    continue
-
-                if end > refData.data[0][-1]:
-                    printError(
-                        "    Evaluation End Point ({}) is bigger then last time stamp of reference results ({}). Skipped.".format(
-                            end, refData.data[0][-1]))
-                    continue
-                if start < refData.data[0][0]:
-                    printError(
-                        "    Evaluation Start Point ({}) is smaller then first time stamp of reference results ({}). Skipped.".format(
-                            end, refData.data[0][0]))
-                    continue
+    tsvData = []
+    for dataFile in toolFiles:
+        if dataFile in cachedResults:
+            printNotification("Results of '{}' taken from result cache.".format(dataFile))
+            tsvData.extend(cachedResults[dataFile])
+        else:
+            tsvData.extend(toolResults[dataFile])
 
-            # check if have an hourly time column
-            try:
-                timeIndicator = tsv.headers[0].split('[')[1].split(']')[0]
-            except Exception as e:
-                printError(str(e))
-                raise Exception(f"Could not convert time unit {tsv.headers[0]} to h.")
-
-            if doCalculation:
-                cols = referenceDf.columns
-                time = cols[0]
-                data = cols[i + 1]
-
-                # if data has not the same order we look for the correct header position
-                # and take its index
-                indexData = tsv.headers.index(rawVariables[i])
-                # indexRef = list(referenceDf.columns).index(rawVariables[i])
-
-                cr = evaluateVariableResults(variables[i], referenceDf[tsv.headers[0]].tolist(), tsv.data[0],
-                                         referenceDf[rawVariables[i]].tolist(),
-                                         tsv.data[indexData], starts, ends, weightFactors, timeIndicator)
-            cr.TestCase = testCaseName
-            cr.ToolID = toolID
-            cr.Variable = variables[i]
-            cr.ErrorCode = 0
-            cr.Unit = rawVariables[i].split("[")[1].split("]")[0].strip()
-
-            if toolID in references:
-                cr.Reference = True
-
-            try:
-                data = toolData.loc[toolData['Tool'] == toolID]
-                cr.DisplayName = data['Tool Name'].item()
-                cr.Version = data['Tool Version'].item()
-                cr.Editor = data['Tool Editor'].item()
-                cr.DisplayColor = data['Tool Color'].item()
-            except Exception as e:
-                printError(str(e))
-                raise Exception(f"Data in 'ToolSpecifications.tsv' in {path} not specified for Tool '{toolID}'")
-
-            tsvData.append(cr)
+    if cache is not None:
+        for dataFile in pendingFiles:
+            cache.set(dataFile, toolKeys[dataFile], toolResults[dataFile])
+        cache.prune(toolFiles)
+        cache.store()
 
     return tsvData
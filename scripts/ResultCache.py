@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Persistent cache for the evaluation results of a single test case.
+#
+# The results of each tool result file are stored together with a key that
+# is built from content hashes of all input files they depend on. Results are
+# only recomputed if one of these files has changed.
+
+import os
+import hashlib
+import pickle
+
+from PrintFuncs import *
+from config import SENTINEL_VALUES
+
+# increase whenever the evaluation changes, so that old cache files are discarded
+CACHE_VERSION = 5
+
+# files in the test case directory that affect the results of all tools
+CASE_INPUT_FILES = ["Reference.tsv", "EvaluationPeriods.tsv", "WeightFactors.tsv", "References.txt",
+                    "ToolSpecifications.tsv"]
+
+
+def fileHash(fname):
+    """Returns the SHA-256 hash of the file content, or an empty string if the file does not exist."""
+    if not os.path.exists(fname):
+        return ""
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def testCaseHash(path, tsvPath, reportNorms=None):
+    """
+    Returns a hash over all input files of the test case in 'path' that affect the
+    results of every tool: the files in CASE_INPUT_FILES and the result files of
+    the tools listed in 'References.txt', which make up the reference results.
+    The requested report norms and the sentinel values are part of the hash, too.
+    """
+    h = hashlib.sha256()
+    h.update(str(CACHE_VERSION).encode())
+    h.update(repr(None if reportNorms is None else sorted(reportNorms)).encode())
+    h.update(repr(sorted(SENTINEL_VALUES)).encode())
+    for fname in CASE_INPUT_FILES:
+        h.update(fileHash(os.path.join(path, fname)).encode())
+    try:
+        with open(os.path.join(path, 'References.txt')) as f:
+            references = f.readline().split(",")
+    except IOError:
+        references = []
+    for toolID in references:
+        h.update(fileHash(os.path.join(tsvPath, toolID + ".tsv")).encode())
+    return h.hexdigest()
+
+
+def toolHash(caseKey, fname):
+    """Returns the key for the results of a tool result file, built from the test case hash and the file content."""
+    h = hashlib.sha256()
+    h.update(caseKey.encode())
+    h.update(fileHash(fname).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Cached evaluation results of one test case, stored as pickle file in the cache directory.
+    """
+
+    def __init__(self, cacheDir, testCaseDir):
+        self.fname = os.path.join(cacheDir, testCaseDir + ".pickle")
+        # key is tool result file name, value is tuple (hash key, list of CaseResults)
+        self.entries = dict()
+
+    def load(self):
+        """Reads the cache file, a missing or unreadable cache file results in an empty cache."""
+        self.entries = dict()
+        if not os.path.exists(self.fname):
+            return
+        try:
+            with open(self.fname, 'rb') as f:
+                version, entries = pickle.load(f)
+            if version == CACHE_VERSION:
+                self.entries = entries
+        except Exception as e:
+            printWarning("    Cannot read result cache '{}', results are recomputed: {}".format(self.fname, str(e)))
+
+    def store(self):
+        """Writes the cache file, the cache directory is created if missing."""
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        tmpName = self.fname + ".tmp"
+        with open(tmpName, 'wb') as f:
+            pickle.dump((CACHE_VERSION, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpName, self.fname)
+
+    def get(self, dataFile, key):
+        """Returns the cached list of CaseResults for the tool result file, or None if missing or outdated."""
+        entry = self.entries.get(dataFile)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def set(self, dataFile, key, results):
+        self.entries[dataFile] = (key, results)
+
+    def prune(self, dataFiles):
+        """Removes entries of tool result files that no longer exist."""
+        for dataFile in list(self.entries.keys()):
+            if dataFile not in dataFiles:
+                del self.entries[dataFile]
+
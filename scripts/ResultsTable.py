@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Columnar table with the evaluation results of all test cases.
+#
+# The CaseResults objects of all test cases are collected into a structured
+# NumPy array with one row per test case, variable and tool and a fixed
+# column per norm. Rating and export work on whole columns.
+#
+# The table also keeps the norms of each evaluation period that the scores
+# were calculated from. It is stored after each run, so that the scores for
+# other weight factors can be calculated without evaluating the data again.
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from ProcessDirectory import NORMS, weightedScore
+from PrintFuncs import *
+
+# increase whenever the stored table changes
+TABLE_VERSION = 2
+
+# norm columns, in the column order of 'Results.tsv'
+NORM_COLUMNS = sorted(NORMS)
+
+# value of norms and scores that could not be calculated
+FAILED = -99
+
+BADGES = {
+    0: "Failed",
+    1: "Perfect",
+    2: "Good",
+    99: "Not Possible"
+}
+
+# text columns of 'Results.tsv'
+INFO_COLUMNS = ["TestCase", "Variable", "ToolID", "DisplayName", "Version", "Unit", "Editor"]
+TEXT_COLUMNS = INFO_COLUMNS + ["DisplayColor", "TestCaseDir"]
+
+# the score keeps the value of CaseResults.score, which is an int for scores clamped to 0 and for
+# results without a calculated score, so that 'Results.tsv' is written like before
+RESULTS_DTYPE = np.dtype([(name, object) for name in TEXT_COLUMNS] +
+                         [("ErrorCode", np.int64)] +
+                         [(norm, np.float64) for norm in NORM_COLUMNS] +
+                         [("Reference", bool), ("score", object), ("simQbadge", np.int64)])
+
+TSV_HEADER = ("Test Case\tVariable\tToolID\tTool Name\tVersion\tUnit\tEditor\tFehlercode\t"
+              "Average [-]\tCVRMSE [%]\tDaily Amplitude CVRMSE [%]\tMBE\tMSE [%]\tMax Difference [-]\tMaximum [-]"
+              "\tMinimum [-]\tNMBE [%]\tNRMSE [%]\tR squared [-]\tRMSE [%]\tRMSEIQR [%]\tRMSLE [%]\tstd dev [-]"
+              "\tReference\tSimQ-Score [%]\tSimQ-Rating\n")
+
+
+def formatValues(values, failed):
+    """
+    Returns the values of a norm column as list of strings: 'failed' marks the values that
+    could not be calculated, they are written as '-99'. Values that were not calculated (NaN)
+    are left empty.
+    """
+    texts = []
+    for v, f in zip(values.tolist(), failed.tolist()):
+        if f:
+            texts.append(str(FAILED))
+        elif v != v:
+            texts.append("")
+        else:
+            texts.append(str(v))
+    return texts
+
+
+class ResultsTable:
+    """
+    Results of all test cases as structured NumPy array 'data' with the columns in RESULTS_DTYPE.
+    Norms that were not calculated are NaN, norms that could not be calculated are FAILED.
+
+    'periodNorms' holds the norms the score of each evaluation period was calculated from,
+    with shape (rows, periods, norms) and norms in the order of NORM_COLUMNS. 'periodCounts'
+    is the number of periods of each row, 0 if no score was calculated, 'skipped' marks
+    the norms of each row that were not calculated and 'failed' the norms that could not
+    be calculated.
+    """
+
+    def __init__(self, data=None, periodNorms=None, periodCounts=None, skipped=None, failed=None):
+        self.data = np.zeros(0, dtype=RESULTS_DTYPE) if data is None else data
+        rows = len(self.data)
+        self.periodNorms = np.full((rows, 0, len(NORM_COLUMNS)), np.nan) if periodNorms is None else periodNorms
+        self.periodCounts = np.zeros(rows, dtype=np.int64) if periodCounts is None else periodCounts
+        self.skipped = np.zeros((rows, len(NORM_COLUMNS)), dtype=bool) if skipped is None else skipped
+        self.failed = np.zeros((rows, len(NORM_COLUMNS)), dtype=bool) if failed is None else failed
+
+    @staticmethod
+    def fromTestResults(testresults):
+        """
+        Creates the table from the dictionary with the lists of CaseResults of all test cases,
+        rows are ordered by test case name. Test cases without results (None) are skipped.
+        """
+        caseResults = []
+        testCaseDirs = []
+        for testcase in sorted(testresults.keys()):
+            # skip test cases with missing/invalid 'Reference.tsv'
+            if testresults[testcase] is not None:
+                caseResults.extend(testresults[testcase])
+                testCaseDirs.extend([testcase] * len(testresults[testcase]))
+
+        data = np.zeros(len(caseResults), dtype=RESULTS_DTYPE)
+        for name in INFO_COLUMNS + ["DisplayColor", "ErrorCode", "Reference", "score", "simQbadge"]:
+            data[name] = [getattr(cr, name) for cr in caseResults]
+        data["TestCaseDir"] = testCaseDirs
+        for norm in NORM_COLUMNS:
+            data[norm] = [np.nan if norm in cr.skippedNorms else cr.norms.get(norm, FAILED) for cr in caseResults]
+        failed = np.array([[norm in cr.failedNorms for norm in NORM_COLUMNS] for cr in caseResults],
+                          dtype=bool).reshape(-1, len(NORM_COLUMNS))
+
+        periodCounts = np.array([0 if cr.periodNorms is None else len(cr.periodNorms) for cr in caseResults],
+                                dtype=np.int64)
+        periodNorms = np.full((len(caseResults), periodCounts.max(initial=0), len(NORM_COLUMNS)), np.nan)
+        skipped = np.zeros((len(caseResults), len(NORM_COLUMNS)), dtype=bool)
+        for row, cr in enumerate(caseResults):
+            for i in range(periodCounts[row]):
+                periodNorms[row, i] = [cr.periodNorms[i].get(norm, FAILED) for norm in NORM_COLUMNS]
+            skipped[row] = [norm in cr.skippedNorms for norm in NORM_COLUMNS]
+        return ResultsTable(data, periodNorms, periodCounts, skipped, failed)
+
+    @staticmethod
+    def load(fname):
+        """Reads a table stored with save(), raises a RuntimeError if the file cannot be read."""
+        try:
+            with open(fname, 'rb') as f:
+                version, table = pickle.load(f)
+        except Exception as e:
+            raise RuntimeError("Cannot read results table '{}': {}".format(fname, str(e)))
+        if version != TABLE_VERSION:
+            raise RuntimeError("Results table '{}' was written by another version, evaluate all test cases "
+                               "again.".format(fname))
+        return table
+
+    def save(self, fname):
+        tmpName = fname + ".tmp"
+        with open(tmpName, 'wb') as f:
+            pickle.dump((TABLE_VERSION, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpName, fname)
+
+    def __len__(self):
+        return len(self.data)
+
+    def _scoredRows(self, testCaseDir):
+        """Returns the rows of the test case with a calculated score."""
+        return np.flatnonzero((self.data["TestCaseDir"] == testCaseDir) & (self.periodCounts > 0))
+
+    def missingNorms(self, weightFactors):
+        """
+        Returns a dictionary that maps the test case directory to the number of results that need
+        a norm for the weight factors in 'weightFactors' (see rescore()), which was not calculated
+        in the evaluation run. Test cases without such results are not listed.
+        """
+        missing = dict()
+        for testCaseDir, factors in weightFactors.items():
+            rows = self._scoredRows(testCaseDir)
+            weighted = [k for k, norm in enumerate(NORM_COLUMNS)
+                        if factors.get(norm, 0) != 0 or (norm == "Max Difference" and norm in factors)]
+            count = np.count_nonzero(self.skipped[rows][:, weighted].any(axis=1))
+            if count > 0:
+                missing[testCaseDir] = count
+        return missing
+
+    def rescore(self, weightFactors):
+        """
+        Returns a copy of the table with the scores and badges calculated from the stored norms
+        of each evaluation period. 'weightFactors' maps the test case directory to the weight
+        factors of the test case (see readWeightFactors()), test cases that are not listed keep
+        their scores. Results without a calculated score keep it as well.
+
+        Raises a RuntimeError if any result needs a norm that was not calculated in the evaluation
+        run (only with the --full-report option all norms are calculated), since the scores of
+        these results cannot be calculated with the new weight factors.
+        """
+        missing = self.missingNorms(weightFactors)
+        if missing:
+            raise RuntimeError("Weight factors need norms that were not calculated in the last evaluation run ({}). "
+                               "Evaluate the test cases again, or with --full-report.".format(
+                                   ", ".join("{}: {} results".format(testCaseDir, count)
+                                             for testCaseDir, count in sorted(missing.items()))))
+
+        data = self.data.copy()
+        for testCaseDir, factors in weightFactors.items():
+            rows = self._scoredRows(testCaseDir)
+            if len(rows) == 0:
+                continue
+
+            # same calculation as in evaluateVariableResults(), for all results at once
+            counts = self.periodCounts[rows]
+            score = np.zeros(len(rows))
+            with np.errstate(all='ignore'):
+                for i in range(counts.max()):
+                    norms = {norm: self.periodNorms[rows, i, k] for k, norm in enumerate(NORM_COLUMNS)}
+                    periodScore = np.where(np.abs(norms['Average']) < 1e-4, 0, score + weightedScore(norms, factors))
+                    score = np.where(i < counts, periodScore, score)
+                score = score / counts
+            data["simQbadge"][rows] = np.where(score >= 90, 1, np.where(score >= 80, 2, 0))
+            # clamped like in evaluateVariableResults(), negative scores become the int 0
+            data["score"][rows] = [max(v, 0) for v in np.round(score, 2)]
+        return ResultsTable(data, self.periodNorms, self.periodCounts, self.skipped, self.failed)
+
+    def ratings(self):
+        """Returns the text of the SimQuality badges of all rows."""
+        badgeCodes = np.array(sorted(BADGES.keys()))
+        badgeTexts = np.array([BADGES[code] for code in badgeCodes] + ["None"], dtype=object)
+        pos = np.searchsorted(badgeCodes, self.data["simQbadge"])
+        known = (pos < len(badgeCodes)) & (badgeCodes[np.minimum(pos, len(badgeCodes) - 1)] == self.data["simQbadge"])
+        return badgeTexts[np.where(known, pos, len(badgeCodes))]
+
+    def toolColors(self):
+        """Returns a dictionary with the display color of each tool."""
+        return dict(zip(self.data["ToolID"].tolist(), self.data["DisplayColor"].tolist()))
+
+    def toDataFrame(self):
+        """Returns the table as DataFrame, with the column names of 'Results.tsv'."""
+        columns = dict()
+        for name in INFO_COLUMNS + ["ErrorCode"] + NORM_COLUMNS + ["Reference"]:
+            columns[name] = self.data[name]
+        columns["score"] = self.data["score"].astype(np.float64)
+        columns["SimQ-Rating"] = self.ratings()
+        df = pd.DataFrame(columns)
+        return df.rename(columns={"TestCase": "Test Case", "DisplayName": "Tool Name", "ErrorCode": "Fehlercode",
+                                  "score": "SimQ-Score"})
+
+    def writeTsv(self, fobj):
+        """Writes the table to the opened text file 'fobj' in the tab-separated format of 'Results.tsv'."""
+        columns = [[str(v) for v in self.data[name].tolist()] for name in INFO_COLUMNS + ["ErrorCode"]]
+        columns += [formatValues(self.data[norm], self.failed[:, k]) for k, norm in enumerate(NORM_COLUMNS)]
+        columns.append([str(v) for v in self.data["Reference"].tolist()])
+        columns.append([str(v) for v in self.data["score"].tolist()])
+        columns.append(self.ratings().tolist())
+        fobj.write(TSV_HEADER)
+        fobj.writelines("\t".join(row) + "\n" for row in zip(*columns))
+
+    def writeFeather(self, fname):
+        """Writes the table as uncompressed feather (Arrow IPC) file."""
+        self.toDataFrame().to_feather(fname, compression="uncompressed")
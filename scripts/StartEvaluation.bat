@@ -1,2 +1,2 @@
-python ScoreCalculation.py
+python ScoreCalculation.py --full-report
 pause
\ No newline at end of file
@@ -11,14 +11,53 @@ import pandas as pd  # Data manipulation and analysis
 import numpy as np
 import math          # used for mathematical calculations
 
-import warnings      # used to catch warnings inside the functions e.g. when some division by zero errors occur
-warnings.filterwarnings("error") 
-
 
 class StatisticsFunctions:
     
     NEAR_ZERO = 1e-5
     
+    ###############################################################################
+    ###                      Masking of invalid norm values                     ###
+    ###############################################################################
+    
+    def Invalid_value_message(value):
+        """Error message for a norm value that is not a finite number."""
+    
+        return "Result is {} (division by zero or invalid value)".format(value)
+    
+    
+    def Calculate_masked_norm(calculation):
+        """Evaluate the norm calculation 'calculation' with floating point errors
+        ignored: divisions by zero or logarithms of negative values give infinite or
+        NaN values instead of warnings, these values are masked afterwards.
+        Returns a tuple (value, error) with the error message, or None as error if
+        the value is a finite number.
+        """
+    
+        try:
+            with np.errstate(all='ignore'):
+                value = calculation()
+        except (RuntimeError, ValueError, ZeroDivisionError) as e:
+            return None, str(e)
+        if not np.isfinite(value):
+            return None, StatisticsFunctions.Invalid_value_message(value)
+        return value, None
+    
+    
+    def Masked_with_nan(data_vector, valid):
+        """Copy of the data with NaN in place of the samples that are not marked in the
+        validity mask 'valid', the data itself if there is no mask. Resampling and the
+        binned amplitudes skip NaN values.
+        """
+    
+        if valid is None:
+            return data_vector
+        values = np.where(valid, np.asarray(data_vector, dtype=np.float64), np.nan)
+        if isinstance(data_vector, pd.Series):
+            return pd.Series(values, index=data_vector.index, name=data_vector.name)
+        return values
+    
+    
     ###############################################################################
     ###                      CVRMSE from diff case - ref                        ###
     ###############################################################################
@@ -32,7 +71,16 @@ class StatisticsFunctions:
         avrg_ref = (reference_vector.mean())    # Average value of the reference = number samples ref * mean average ref
         square_diff = diff_case_ref ** 2        
         sum_squares = square_diff.sum()
-        CVRMSE = ((math.sqrt(sum_squares / nbr_samples)) / avrg_ref) * 100
+        
+        return StatisticsFunctions.Calculate_CVRMSE_from_sum_squares(sum_squares, nbr_samples, avrg_ref)
+    
+    
+    def Calculate_CVRMSE_from_sum_squares(sum_squares, nbr_samples, avrg_ref):
+        """CVRMSE [%] from the sum of the squared differences between case and
+        reference, the number of samples and the average value of the reference.
+        """
+    
+        CVRMSE = ((np.sqrt(sum_squares / nbr_samples)) / avrg_ref) * 100
         
         return CVRMSE
     
@@ -59,6 +107,67 @@ class StatisticsFunctions:
     
         return daily_amplitude_vector
     
+    
+    ###############################################################################
+    ###                               Time bins                                 ###
+    ###############################################################################
+    
+    def Calculate_time_bins(date_and_time_stamp_vect, bin_minutes):
+        """Assign the samples to time bins of 'bin_minutes' length starting at
+        midnight of the first day, the same bins as with resample(..., on="Date
+        and Time"), but using integer bin indices instead of a calendar.
+        Returns a tuple with the first sample index and the number of samples of
+        each bin, and the time stamps of the bins. Returns None for empty or
+        unsorted time stamps, these need to be resampled.
+        """
+    
+        time_stamps = np.asarray(date_and_time_stamp_vect, dtype="datetime64[ns]").view(np.int64)
+        if len(time_stamps) == 0 or np.any(np.diff(time_stamps) < 0):
+            return None
+    
+        bin_length = bin_minutes * 60 * 1000000000
+        day_length = 24 * 60 * 60 * 1000000000
+        origin = time_stamps[0] - time_stamps[0] % day_length  # midnight of the first day
+        bins = (time_stamps - origin) // bin_length
+        # bins before the first sample are not part of the result
+        first_bin = bins[0]
+        nbr_bins = bins[-1] - first_bin + 1
+    
+        bin_starts = np.searchsorted(bins, np.arange(first_bin, first_bin + nbr_bins), side="left")
+        bin_sizes = np.diff(np.append(bin_starts, len(bins)))
+        bin_stamps = pd.date_range(start=pd.Timestamp(origin + first_bin * bin_length), periods=nbr_bins,
+                                   freq="{}min".format(bin_minutes), name="Date and Time")
+        return bin_starts, bin_sizes, bin_stamps
+    
+    
+    def Calculate_binned_amplitude(data_vector, time_bins):
+        """Amplitude (max - min) of the data within each of the time bins from
+        Calculate_time_bins(), NaN for bins without data.
+        """
+    
+        bin_starts, bin_sizes, bin_stamps = time_bins
+        values = np.asarray(data_vector, dtype=np.float64)
+        # fmax/fmin skip NaN values like resample does, empty bins are set to NaN afterwards
+        amplitude = np.fmax.reduceat(values, bin_starts) - np.fmin.reduceat(values, bin_starts)
+        amplitude[bin_sizes == 0] = np.nan
+        return pd.Series(amplitude, index=bin_stamps)
+    
+    
+    def Calculate_binned_mean(data_vector, time_bins):
+        """Mean value of the data within each of the time bins from
+        Calculate_time_bins(), NaN for bins without data.
+        """
+    
+        bin_starts, bin_sizes, bin_stamps = time_bins
+        values = np.asarray(data_vector, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values, 0), bin_starts)
+        counts = np.add.reduceat(valid.astype(np.int64), bin_starts)
+        counts[bin_sizes == 0] = 0
+        mean = np.full(len(bin_starts), np.nan)
+        np.divide(sums, counts, out=mean, where=counts > 0)
+        return pd.Series(mean, index=bin_stamps)
+    
 
     "#############################################################################"
     "##                   KPIs / Comparison Metrics functions                   ##"
@@ -111,12 +220,16 @@ class StatisticsFunctions:
         diff_case_ref = test_case_vector - reference_vector  # Case - Reference
     
         "Resampling"
-        frames = [date_and_time_stamp_vect, diff_case_ref]  # The 2 df to concat
-        diff_case_ref = pd.concat(frames, axis=1, join="outer")  # date and time followed by data on the right
-        """With resample .mean(), the date and time stamp column replaces the index
-        column, so no need to select data column if only 1 data column for further
-        calculation"""
-        diff_case_ref = diff_case_ref.resample("60min", on="Date and Time").mean()  # Resample as hourly mean average: the time stamp column becomes index column
+        time_bins = StatisticsFunctions.Calculate_time_bins(date_and_time_stamp_vect, 60)
+        if time_bins is not None:
+            diff_case_ref = StatisticsFunctions.Calculate_binned_mean(diff_case_ref, time_bins)
+        else:
+            frames = [date_and_time_stamp_vect, diff_case_ref]  # The 2 df to concat
+            diff_case_ref = pd.concat(frames, axis=1, join="outer")  # date and time followed by data on the right
+            """With resample .mean(), the date and time stamp column replaces the index
+            column, so no need to select data column if only 1 data column for further
+            calculation"""
+            diff_case_ref = diff_case_ref.resample("60min", on="Date and Time").mean()  # Resample as hourly mean average: the time stamp column becomes index column
     
         hourly_CVRMSE = StatisticsFunctions.Calculate_CVRMSE_from_diff_case_ref(diff_case_ref, reference_vector)
     
@@ -130,20 +243,31 @@ class StatisticsFunctions:
     def function_Daily_Amplitude_CVRMSE(
             reference_vector,
             test_case_vector,
-            date_and_time_stamp_vect):
+            date_and_time_stamp_vect,
+            reference_statistics=None,
+            valid=None):
         """CVRMSE of the daily amplitude from midnight to midnight: Need resampling
         at 1440 min.
+        The daily amplitude of the reference profile is taken from 'reference_statistics',
+        a ReferenceStatistics object, if given.
+        Only the samples marked in the validity mask 'valid' are used, if given.
         """
     
+        if reference_statistics is None:
+            reference_statistics = ReferenceStatistics(reference_vector, date_and_time_stamp_vect, valid)
+        test_case_vector = StatisticsFunctions.Masked_with_nan(test_case_vector, valid)
+    
         "Daily amplitude test case"
-        frames = [date_and_time_stamp_vect, test_case_vector]  # The 2 df to concat
-        input_vector = pd.concat(frames, axis=1, join="outer")  # date and time followed by data on the right
-        Daily_amplitude_case = StatisticsFunctions.Calculate_daily_amplitude(input_vector)  # Get daily amplitude user test data
+        day_bins = reference_statistics.day_bins()
+        if day_bins is not None and len(test_case_vector) == len(date_and_time_stamp_vect):
+            Daily_amplitude_case = StatisticsFunctions.Calculate_binned_amplitude(test_case_vector, day_bins)
+        else:
+            frames = [date_and_time_stamp_vect, test_case_vector]  # The 2 df to concat
+            input_vector = pd.concat(frames, axis=1, join="outer")  # date and time followed by data on the right
+            Daily_amplitude_case = StatisticsFunctions.Calculate_daily_amplitude(input_vector)  # Get daily amplitude user test data
     
         "Daily amplitude reference profile"
-        frames = [date_and_time_stamp_vect, reference_vector]  # The 2 df to concat
-        input_vector = pd.concat(frames, axis=1, join="outer")  # date and time followed by data on the right
-        Daily_amplitude_reference = StatisticsFunctions.Calculate_daily_amplitude(input_vector)  # Get daily amplitude user test data
+        Daily_amplitude_reference = reference_statistics.daily_amplitude()
     
         "Difference daily amplitude between test case and reference"
         Diff_daily_aimplitude_case_ref = Daily_amplitude_case - Daily_amplitude_reference
@@ -437,3 +561,324 @@ class StatisticsFunctions:
 
         return round(max(diff.abs()), 2)
 
+
+    ###############################################################################
+    ###                  All norms from shared intermediates                    ###
+    ###############################################################################
+
+    def function_all_norms(reference_vector, test_case_vector, date_and_time_stamp_vect, norms=None,
+                           reference_statistics=None, valid=None):
+        """Calculate all norms except the Daily Amplitude CVRMSE in a single pass.
+        Residuals, sums and reference statistics are computed only once and shared
+        by all norms, instead of being recomputed in each of the function_xxx() calls.
+        Results are identical to those of the individual functions.
+        With a list of norm names in 'norms' only these norms are calculated.
+        Intermediates of the reference data are taken from 'reference_statistics',
+        a ReferenceStatistics object with the same validity mask, if given.
+        With a validity mask 'valid' only the marked samples are used, the sums skip
+        the other samples without copying the data.
+
+        Returns a tuple of two dictionaries: the calculated norms and, for each norm
+        that could not be calculated, the error message.
+        """
+
+        "y: observations / reality / measured data / reference data"
+        "f: prediction / fitted data / modeled data / test data"
+
+        if reference_statistics is None:
+            reference_statistics = ReferenceStatistics(reference_vector, date_and_time_stamp_vect, valid)
+        ref = reference_statistics
+
+        y = ref.y
+        f = np.asarray(test_case_vector, dtype=np.float64)
+
+        nbr_samples = len(f) if valid is None else np.count_nonzero(valid)
+
+        "Reductions over the valid samples"
+        where = dict() if valid is None else {"where": valid}
+        def maximum(v):
+            return v.max() if valid is None else v.max(where=valid, initial=-np.inf)
+        def minimum(v):
+            return v.min() if valid is None else v.min(where=valid, initial=np.inf)
+
+        "Shared intermediates"
+        diff_case_ref = f - y                       # Case - Reference
+        abs_diff = np.abs(diff_case_ref)
+        sum_diff = diff_case_ref.sum(**where)
+        sum_squares_diff = (diff_case_ref ** 2).sum(**where)
+        sum_case = f.sum(**where)
+
+        "Sums over the data that are only needed by some norms"
+        sums = {
+            "max_abs_diff":         lambda: maximum(abs_diff),
+            "maximum":              lambda: maximum(f),
+            "minimum":              lambda: minimum(f),
+            "sum_squares_logs":     lambda: ((np.log(f + 1) - ref.log_values()) ** 2).sum(**where),
+            "sum_squares_average":  lambda: ((f - sum_case / nbr_samples) ** 2).sum(**where)
+        }
+
+        return StatisticsFunctions.Calculate_norms_from_sums(ref, nbr_samples, sum_diff, sum_squares_diff, sum_case,
+                                                             sums, norms)
+
+
+    def Calculate_norms_from_sums(ref, nbr_samples, sum_diff, sum_squares_diff, sum_case, sums, norms=None):
+        """Calculate the norms of function_all_norms() from the sums over the test case
+        data. 'sums' holds functions for the sums that are only needed by some norms,
+        see function_all_norms().
+
+        Returns a tuple of two dictionaries: the calculated norms and, for each norm
+        that could not be calculated, the error message.
+        """
+
+        values, errors = StatisticsFunctions.Calculate_norm_values(ref, nbr_samples, sum_diff, sum_squares_diff,
+                                                                   sum_case, sums, norms)
+        results = dict()
+        for norm, value in values.items():
+            if np.isfinite(value):
+                results[norm] = value
+            else:
+                errors[norm] = StatisticsFunctions.Invalid_value_message(value)
+
+        return results, errors
+
+
+    def Calculate_norm_values(ref, nbr_samples, sum_diff, sum_squares_diff, sum_case, sums, norms=None):
+        """Calculate the rounded norm values of Calculate_norms_from_sums(), the sums may
+        also be arrays with one value per test case. Floating point errors are ignored,
+        norms that cannot be calculated, e.g. because of a division by zero, are NaN or
+        infinite and have to be masked by the caller.
+
+        Returns a tuple of two dictionaries: the norm values and, for each norm whose
+        calculation failed otherwise (e.g. for empty data sets), the error message.
+        """
+
+        "Divisions may fail for empty data sets, so they are only done within the norm calculations"
+        def MSE():
+            return sum_squares_diff / nbr_samples
+
+        def avrg_case():
+            return sum_case / nbr_samples
+
+        def RMSE():
+            return np.sqrt(MSE())
+
+        def CVRMSE():
+            return (RMSE() / ref.cvrmse_average()) * 100
+
+        def NRMSE():
+            return (RMSE() / ref.amplitude()) * 100
+
+        def RMSEIQR():
+            return (RMSE() / ref.interquartile_range()) * 100
+
+        def RMSLE():
+            return np.sqrt(sums["sum_squares_logs"]() / nbr_samples)
+
+        def R_squared():
+            return (1 - (sum_squares_diff / ref.total_sum_of_squares())) * 100
+
+        def std_dev():
+            return np.sqrt(sums["sum_squares_average"]() / nbr_samples)
+
+        calculations = {
+            "Average":          (avrg_case, 2),
+            "CVRMSE":           (CVRMSE, 2),
+            "MBE":              (lambda: sum_diff / ref.count, 2),
+            "MSE":              (MSE, 2),
+            "Max Difference":   (sums["max_abs_diff"], 2),
+            "Maximum":          (sums["maximum"], 2),
+            "Minimum":          (sums["minimum"], 2),
+            "NMBE":             (lambda: sum_diff * 100 / ref.sum_ref, 2),
+            "NRMSE":            (NRMSE, 2),
+            "R squared":        (R_squared, 2),
+            "RMSE":             (RMSE, 2),
+            "RMSEIQR":          (RMSEIQR, 2),
+            "RMSLE":            (RMSLE, 5),
+            "std dev":          (std_dev, 2)
+        }
+
+        values = dict()
+        errors = dict()
+        with np.errstate(all='ignore'):
+            for norm, (calculation, digits) in calculations.items():
+                if norms is not None and norm not in norms:
+                    continue
+                try:
+                    value = calculation()
+                    values[norm] = np.round(value, digits) if isinstance(value, np.ndarray) else round(value, digits)
+                except (RuntimeError, ValueError) as e:
+                    errors[norm] = str(e)
+
+        return values, errors
+
+
+    def function_batch_norms(reference_statistics, test_case_matrix, norms=None):
+        """Calculate the norms of function_all_norms() and the Daily Amplitude CVRMSE for
+        several test cases at once, 'test_case_matrix' holds one test case per row and all
+        test cases share the reference data and time stamps of 'reference_statistics', a
+        ReferenceStatistics object. The sums over the data and the norms are calculated
+        for all test cases at once, with the same results as for a single test case.
+        With a list of norm names in 'norms' only these norms are calculated.
+
+        Returns a list with a tuple (results, errors) for each test case, like
+        function_all_norms(), or None if the norms have to be calculated for each test
+        case on its own, i.e. when the daily amplitude requires resampling.
+        """
+
+        ref = reference_statistics
+        f = np.asarray(test_case_matrix, dtype=np.float64)
+        if f.ndim != 2 or f.shape[1] == 0 or f.shape[1] != len(ref.y):
+            return None
+        nbr_samples = f.shape[1]
+
+        def requested(norm):
+            return norms is None or norm in norms
+
+        "Intermediates of the reference data"
+        if requested("Daily Amplitude CVRMSE"):
+            try:
+                day_bins = ref.day_bins()
+                if day_bins is None or len(ref.date_and_time_stamp_vect) != nbr_samples:
+                    return None
+                amplitude_reference = ref.daily_amplitude()
+                avrg_amplitude_reference = amplitude_reference.mean()
+            except (RuntimeError, ValueError):
+                return None
+
+        "Sums for all test cases, None if the norm is not requested"
+        with np.errstate(all='ignore'):
+            diff_case_ref = f - ref.y
+            sum_diff = diff_case_ref.sum(axis=1)
+            sum_squares_diff = (diff_case_ref ** 2).sum(axis=1)
+            sum_case = f.sum(axis=1)
+
+            sums = {
+                "max_abs_diff":         lambda: np.abs(diff_case_ref).max(axis=1),
+                "maximum":              lambda: f.max(axis=1),
+                "minimum":              lambda: f.min(axis=1),
+                "sum_squares_logs":     lambda: ((np.log(f + 1) - ref.log_values()) ** 2).sum(axis=1),
+                "sum_squares_average":  lambda: ((f - (sum_case / nbr_samples)[:, np.newaxis]) ** 2).sum(axis=1)
+            }
+
+            values = dict()
+            if requested("Daily Amplitude CVRMSE"):
+                bin_starts, bin_sizes, bin_stamps = day_bins
+                amplitude = np.fmax.reduceat(f, bin_starts, axis=1) - np.fmin.reduceat(f, bin_starts, axis=1)
+                amplitude[:, bin_sizes == 0] = np.nan
+                # days without data are skipped, like in the sum of a Series
+                square_diff = (amplitude - amplitude_reference.to_numpy()) ** 2
+                sum_squares_amplitude = np.where(np.isnan(square_diff), 0, square_diff).sum(axis=1)
+                values["Daily Amplitude CVRMSE"] = np.round(StatisticsFunctions.Calculate_CVRMSE_from_sum_squares(
+                    sum_squares_amplitude, len(bin_starts), avrg_amplitude_reference), 2)
+
+        normValues, normErrors = StatisticsFunctions.Calculate_norm_values(
+            ref, nbr_samples, sum_diff, sum_squares_diff, sum_case, sums, norms)
+        values.update(normValues)
+
+        "Norms that are not finite could not be calculated"
+        valid = {norm: np.isfinite(value) for norm, value in values.items()}
+        batch = []
+        for k in range(len(f)):
+            results = dict()
+            errors = dict()
+            for norm, value in values.items():
+                if valid[norm][k]:
+                    results[norm] = value[k]
+                else:
+                    errors[norm] = StatisticsFunctions.Invalid_value_message(value[k])
+            errors.update(normErrors)
+            batch.append((results, errors))
+
+        return batch
+
+
+class ReferenceStatistics:
+    """Intermediates that only depend on the reference data of a variable and
+    evaluation period: averages, amplitude, interquartile range, total sum of
+    squares and the daily amplitude. They are calculated on first use, so that one
+    object can be shared by the evaluation of all tools.
+    With a validity mask 'valid' only the marked samples are used, the object can
+    then only be shared by tools with the same mask.
+    Calculations that fail raise the same error again on every later use.
+    """
+
+    def __init__(self, reference_vector, date_and_time_stamp_vect, valid=None):
+        self.reference_vector = reference_vector
+        self.date_and_time_stamp_vect = date_and_time_stamp_vect
+        self.valid = valid
+        self.y = np.asarray(reference_vector, dtype=np.float64)
+        if valid is None:
+            self.count = len(self.y)
+            self.sum_ref = self.y.sum()
+        else:
+            self.count = np.count_nonzero(valid)
+            self.sum_ref = self.y.sum(where=valid)
+        self._values = dict()
+
+    def _get(self, name, calculation):
+        if name not in self._values:
+            try:
+                # values that cannot be calculated are NaN or infinite, see Calculate_masked_norm()
+                with np.errstate(all='ignore'):
+                    self._values[name] = (calculation(), None)
+            except (RuntimeError, ValueError) as e:
+                self._values[name] = (None, e)
+        value, error = self._values[name]
+        if error is not None:
+            raise error.with_traceback(None)
+        return value
+
+    def average(self):
+        return self._get("average", lambda: self.sum_ref / self.count)
+
+    def cvrmse_average(self):
+        """Average of the reference data, replaced by NEAR_ZERO if close to zero."""
+        def calculation():
+            # division through zero handling
+            avrg = self.average()
+            if math.isclose(avrg, 0):
+                avrg = StatisticsFunctions.NEAR_ZERO
+            return avrg
+        return self._get("cvrmse_average", calculation)
+
+    def amplitude(self):
+        def calculation():
+            if self.valid is None:
+                return self.y.max() - self.y.min()
+            return self.y.max(where=self.valid, initial=-np.inf) - self.y.min(where=self.valid, initial=np.inf)
+        return self._get("amplitude", calculation)
+
+    def interquartile_range(self):
+        def calculation():
+            y = self.y if self.valid is None else self.y[self.valid]
+            if len(y) == 0:
+                return np.nan
+            q75, q25 = np.percentile(y, [75, 25])  # 75th and 25th percentiles of ref data
+            return q75 - q25
+        return self._get("interquartile_range", calculation)
+
+    def log_values(self):
+        return self._get("log_values", lambda: np.log(self.y + 1))
+
+    def total_sum_of_squares(self):
+        "SStot: total sum of squares (proportional to the variance of the data)"
+        def calculation():
+            squares = (self.y - self.average()) ** 2
+            return squares.sum() if self.valid is None else squares.sum(where=self.valid)
+        return self._get("total_sum_of_squares", calculation)
+
+    def day_bins(self):
+        """Daily time bins from StatisticsFunctions.Calculate_time_bins(), None if resampling is needed."""
+        return self._get("day_bins",
+                         lambda: StatisticsFunctions.Calculate_time_bins(self.date_and_time_stamp_vect, 1440))
+
+    def daily_amplitude(self):
+        def calculation():
+            day_bins = self.day_bins()
+            reference_vector = StatisticsFunctions.Masked_with_nan(self.reference_vector, self.valid)
+            if day_bins is not None:
+                return StatisticsFunctions.Calculate_binned_amplitude(reference_vector, day_bins)
+            frames = [self.date_and_time_stamp_vect, reference_vector]  # The 2 df to concat
+            input_vector = pd.concat(frames, axis=1, join="outer")  # date and time followed by data on the right
+            return StatisticsFunctions.Calculate_daily_amplitude(input_vector)
+        return self._get("daily_amplitude", calculation)
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# STREAMING STATISTICS
+#
+# Online accumulators for the norms of a test case data set that is read chunk by
+# chunk, so that tool result files of arbitrary length can be scored in a single pass
+# without keeping the test case data in memory. Accumulators of different parts of a
+# data set can be merged, e.g. the parts of several evaluation periods.
+#
+# Only the test case side is accumulated: the reference results are always kept in
+# memory, so their intermediates (averages, interquartile range, daily amplitudes)
+# are taken from a ReferenceStatistics object and are exact. Norms are calculated by
+# StatisticsFunctions.Calculate_norms_from_sums() and are the same as for the data in
+# memory, up to rounding differences caused by the different summation order.
+
+import numpy as np
+import pandas as pd
+
+from StatisticsFunctions import StatisticsFunctions
+
+# length of a day in nanoseconds, the unit of the time stamps
+DAY_LENGTH = 24 * 60 * 60 * 1000000000
+
+
+class NormAccumulator:
+    """
+    Accumulates the sums over the test case data that are needed for all norms, and the
+    daily minimum and maximum values of the test case data for the daily amplitudes.
+    Only valid samples must be added, see function_all_norms().
+    """
+
+    def __init__(self):
+        # NumPy floats, so that divisions by zero give infinite or NaN values like for the data in memory
+        self.count = 0
+        self.sumDiff = np.float64(0)        # sum of (test - reference)
+        self.sumSquaresDiff = np.float64(0)
+        self.sumCase = np.float64(0)
+        self.m2Case = np.float64(0)         # sum of squared differences to the mean of the test data
+        self.maxAbsDiff = np.float64(-np.inf)
+        self.maxCase = np.float64(-np.inf)
+        self.minCase = np.float64(np.inf)
+        self.sumSquaresLogDiff = np.float64(0)
+        # days with data, as day index of the time stamps, and the daily minimum and maximum test values
+        self.days = np.empty(0, dtype=np.int64)
+        self.dailyMin = np.empty(0)
+        self.dailyMax = np.empty(0)
+
+    def update(self, referenceVector, testVector, timeStamps):
+        """Adds a chunk of reference and test data with the time stamps used for the daily amplitudes."""
+        y = np.asarray(referenceVector, dtype=np.float64)
+        f = np.asarray(testVector, dtype=np.float64)
+        if len(y) == 0:
+            return
+        chunk = NormAccumulator()
+        with np.errstate(all='ignore'):
+            diff = f - y
+            chunk.count = len(f)
+            chunk.sumDiff = diff.sum()
+            chunk.sumSquaresDiff = (diff ** 2).sum()
+            chunk.sumCase = f.sum()
+            chunk.m2Case = ((f - chunk.sumCase / chunk.count) ** 2).sum()
+            chunk.maxAbsDiff = np.abs(diff).max()
+            chunk.maxCase = f.max()
+            chunk.minCase = f.min()
+            chunk.sumSquaresLogDiff = ((np.log(f + 1) - np.log(y + 1)) ** 2).sum()
+        days = np.asarray(timeStamps, dtype="datetime64[ns]").view(np.int64) // DAY_LENGTH
+        chunk._addDays(days, f, f)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Adds the data of another accumulator."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return
+        n = self.count + other.count
+        with np.errstate(all='ignore'):
+            # parallel algorithm for the sum of squared differences to the mean
+            delta = other.sumCase / other.count - self.sumCase / self.count
+            self.m2Case += other.m2Case + delta ** 2 * self.count * other.count / n
+            self.sumDiff += other.sumDiff
+            self.sumSquaresDiff += other.sumSquaresDiff
+            self.sumCase += other.sumCase
+            self.sumSquaresLogDiff += other.sumSquaresLogDiff
+        self.count = n
+        self.maxAbsDiff = max(self.maxAbsDiff, other.maxAbsDiff)
+        self.maxCase = max(self.maxCase, other.maxCase)
+        self.minCase = min(self.minCase, other.minCase)
+        self._addDays(other.days, other.dailyMin, other.dailyMax)
+
+    def _addDays(self, days, minValues, maxValues):
+        """Adds minimum and maximum values of the given days, values of the same day are combined."""
+        days, inverse = np.unique(np.concatenate([self.days, days]), return_inverse=True)
+        dailyMin = np.full(len(days), np.inf)
+        dailyMax = np.full(len(days), -np.inf)
+        np.minimum.at(dailyMin, inverse, np.concatenate([self.dailyMin, minValues]))
+        np.maximum.at(dailyMax, inverse, np.concatenate([self.dailyMax, maxValues]))
+        self.days = days
+        self.dailyMin = dailyMin
+        self.dailyMax = dailyMax
+
+    def _dailyAmplitudeCVRMSE(self, reference_statistics):
+        """Daily Amplitude CVRMSE like in function_Daily_Amplitude_CVRMSE(), days without data are NaN."""
+        amplitude_reference = reference_statistics.daily_amplitude()
+        amplitude_case = np.full(len(amplitude_reference), np.nan)
+        if len(amplitude_reference) > 0:
+            positions = self.days - amplitude_reference.index[0].value // DAY_LENGTH
+            inside = (positions >= 0) & (positions < len(amplitude_case))
+            amplitude_case[positions[inside]] = (self.dailyMax - self.dailyMin)[inside]
+        diff_case_ref = pd.Series(amplitude_case, index=amplitude_reference.index) - amplitude_reference
+        return round(StatisticsFunctions.Calculate_CVRMSE_from_diff_case_ref(diff_case_ref, amplitude_reference), 2)
+
+    def norms(self, reference_statistics, norms=None):
+        """
+        Calculates the norms from the accumulated data and 'reference_statistics', the
+        ReferenceStatistics object of the reference data with the same samples. With a list
+        of norm names in 'norms' only these norms are calculated.
+
+        Returns a tuple of two dictionaries: the calculated norms and, for each norm
+        that could not be calculated, the error message.
+        """
+        results = dict()
+        errors = dict()
+        if norms is None or "Daily Amplitude CVRMSE" in norms:
+            value, error = StatisticsFunctions.Calculate_masked_norm(
+                lambda: self._dailyAmplitudeCVRMSE(reference_statistics))
+            if error is None:
+                results["Daily Amplitude CVRMSE"] = value
+            else:
+                errors["Daily Amplitude CVRMSE"] = error
+
+        sums = {
+            "max_abs_diff":         lambda: self.maxAbsDiff,
+            "maximum":              lambda: self.maxCase,
+            "minimum":              lambda: self.minCase,
+            "sum_squares_logs":     lambda: self.sumSquaresLogDiff,
+            "sum_squares_average":  lambda: self.m2Case
+        }
+        normResults, normErrors = StatisticsFunctions.Calculate_norms_from_sums(
+            reference_statistics, self.count, self.sumDiff, self.sumSquaresDiff, self.sumCase, sums, norms)
+        results.update(normResults)
+        errors.update(normErrors)
+        return results, errors
@@ -3,6 +3,21 @@
 
 # A reader/writer/manipulator class for TSV files
 
+import os
+import json
+import hashlib
+import numpy as np
+
+# increase whenever the parsing changes, so that old binary cache files are discarded
+PARSE_CACHE_VERSION = 2
+
+# number of data rows that are parsed at once, one year of hourly values
+CHUNK_SIZE = 8760
+
+# length of the units of the time column in seconds
+TIME_UNITS = {"s": 1, "min": 60, "h": 3600, "d": 86400}
+
+
 class TSVContainer:
 
     def __init__(self):
@@ -13,6 +28,11 @@ class TSVContainer:
         self.headers = []
         # empty flag - True for all columns that have only empty strings except for header
         self.emptyColumn = []
+        # validity masks of the columns - boolean arrays with False for empty cells, NaN and
+        # sentinel values, None if all cells of a column are valid
+        self.valid = []
+        # values that mark invalid cells, see readAsArrays()
+        self.sentinels = []
 
     def readAsStrings(self, fname):
         """Reads the file but keeps all tokens as strings"""
@@ -62,6 +82,354 @@ class TSVContainer:
             print(str(e))
             raise RuntimeError("Error reading file '{}'".format(fname))
 
+    def readAsArrays(self, fname, cacheDir=None, sentinels=()):
+        """
+        Reads the file and converts all tokens directly to floats. Each column is stored
+        as contiguous numpy float64 array. A 0.0 is stored in place of empty cells.
+        Header, empty column flags and error messages are the same as with
+        readAsStrings() followed by convert2Double().
+
+        Empty cells, NaN values and cells with one of the values in 'sentinels' are marked
+        as invalid in the validity masks 'valid'.
+
+        With a cacheDir given, successfully parsed data is stored there in binary form and
+        memory-mapped by later calls instead of parsing the file again, as long as the file
+        is unchanged. The columns are read-only then.
+
+        **Return Value**
+
+        Returns *True* if successful, returns *False* if any value couldn't be converted.
+        """
+        self.sentinels = sorted(float(v) for v in sentinels)
+        if cacheDir is not None and self._loadCache(fname, cacheDir):
+            return True
+        fobj = self._open(fname)
+        with fobj:
+            # the line count is an upper bound for the number of data rows, so that the file is
+            # parsed chunk by chunk into one (columns x rows) array, each row holds one column
+            lineCount = sum(1 for l in fobj)
+            fobj.seek(0)
+            values = None
+            blankCells = []
+            rowCount = 0
+            error = None
+            for lines in self._lineChunks(fobj, CHUNK_SIZE):
+                if values is None:
+                    values = np.empty((len(self.headers), lineCount - 1), dtype=np.float64)
+                    blankCells = [None] * len(self.headers)
+                    self.emptyColumn = [True] * len(self.headers)
+                chunkBlankCells, chunkError = self._convertLines(lines, values[:, rowCount:rowCount + len(lines)],
+                                                                 rowCount)
+                for colIdx, blank in enumerate(chunkBlankCells):
+                    if blank is None:
+                        self.emptyColumn[colIdx] = False
+                        continue
+                    if blankCells[colIdx] is None:
+                        blankCells[colIdx] = np.zeros(lineCount - 1, dtype=bool)
+                    blankCells[colIdx][rowCount:rowCount + len(lines)] = blank
+                    self.emptyColumn[colIdx] = self.emptyColumn[colIdx] and bool(blank.all())
+                if error is None:
+                    error = chunkError
+                rowCount += len(lines)
+
+        if len(self.headers) == 0:
+            raise RuntimeError("Missing in header line, empty file?")
+        if rowCount <= 1:
+            raise RuntimeError("Missing data, only one line in file?")
+
+        print("  {} columns, {} data rows, ".format(len(self.headers), rowCount - 1))
+
+        if error is not None:
+            print(error)
+            return False
+        # trailing lines after the first empty line are not part of the data
+        values = values[:, :rowCount]
+        self.data = [values[colIdx] for colIdx in range(len(self.headers))]
+        self.valid = [self._validityMask(self.data[colIdx],
+                                         None if blankCells[colIdx] is None else blankCells[colIdx][:rowCount])
+                      for colIdx in range(len(self.headers))]
+        if cacheDir is not None:
+            self._storeCache(fname, cacheDir, values)
+        return True
+
+    def readChunks(self, fname, chunkSize=CHUNK_SIZE, sentinels=()):
+        """
+        Generator that reads the file in chunks of at most 'chunkSize' data rows, so that
+        files of arbitrary length can be processed with bounded memory. The header is
+        read first, then each chunk is yielded as tuple (values, valid) with a (columns x rows)
+        float64 array, whose rows hold the columns with a 0.0 in place of empty cells, and the
+        validity masks of the columns like in readAsArrays(). 'emptyColumn' is complete once
+        all chunks have been read.
+
+        Raises a RuntimeError for malformed files and for values that couldn't be converted.
+        """
+        self.sentinels = sorted(float(v) for v in sentinels)
+        fobj = self._open(fname)
+        rowCount = 0
+        with fobj:
+            for lines in self._lineChunks(fobj, chunkSize):
+                if rowCount == 0:
+                    self.emptyColumn = [True] * len(self.headers)
+                values = np.empty((len(self.headers), len(lines)), dtype=np.float64)
+                blankCells, error = self._convertLines(lines, values, rowCount)
+                if error is not None:
+                    raise RuntimeError(error)
+                for colIdx, blank in enumerate(blankCells):
+                    self.emptyColumn[colIdx] = self.emptyColumn[colIdx] and blank is not None and bool(blank.all())
+                rowCount += len(lines)
+                yield values, [self._validityMask(values[colIdx], blankCells[colIdx])
+                               for colIdx in range(len(self.headers))]
+
+        if len(self.headers) == 0:
+            raise RuntimeError("Missing in header line, empty file?")
+        if rowCount <= 1:
+            raise RuntimeError("Missing data, only one line in file?")
+
+        print("  {} columns, {} data rows, ".format(len(self.headers), rowCount - 1))
+
+    @staticmethod
+    def _open(fname):
+        """Opens the file for reading, IO errors are reported as RuntimeError."""
+        try:
+            print("Reading {}".format(fname))
+            return open(fname, 'r', encoding="utf-8", errors='ignore')
+        except IOError as e:
+            print(str(e))
+            raise RuntimeError("Error reading file '{}'".format(fname))
+
+    def _validityMask(self, values, blank=None):
+        """
+        Returns the validity mask of a float64 column, with False for NaN values, sentinel
+        values and the empty cells marked in 'blank'. Returns None if all cells are valid.
+        """
+        valid = np.isfinite(values)
+        if len(self.sentinels) > 0:
+            valid &= ~np.isin(values, self.sentinels)
+        if blank is not None:
+            valid &= ~blank
+        if valid.all():
+            return None
+        return valid
+
+    @staticmethod
+    def _cacheFileNames(fname, cacheDir):
+        """Returns the names of the binary data file, the validity mask file and the description file in the cache."""
+        base = os.path.join(cacheDir, os.path.basename(fname))
+        return base + ".npy", base + ".mask.npy", base + ".json"
+
+    @staticmethod
+    def _fileHash(fname):
+        h = hashlib.sha256()
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _loadCache(self, fname, cacheDir):
+        """
+        Memory-maps the cached data of the file, if the file still has the same size and
+        modification time or the same content hash. Returns True if successful.
+        """
+        npyName, maskName, jsonName = self._cacheFileNames(fname, cacheDir)
+        try:
+            with open(jsonName, 'r', encoding="utf-8") as f:
+                info = json.load(f)
+            stat = os.stat(fname)
+            if info["version"] != PARSE_CACHE_VERSION or info["size"] != stat.st_size:
+                return False
+            # the validity masks depend on the sentinel values
+            if info["sentinels"] != self.sentinels:
+                return False
+            if info["mtime"] != stat.st_mtime_ns:
+                # file was touched, but may be unchanged
+                if info["hash"] != self._fileHash(fname):
+                    return False
+                info["mtime"] = stat.st_mtime_ns
+                self._writeAtomic(jsonName, lambda f: json.dump(info, f))
+            # one row per column, so that columns are contiguous
+            values = np.load(npyName, mmap_mode='r')
+            if values.shape != (len(info["headers"]), info["rows"]):
+                return False
+            # only columns with invalid cells have a mask
+            masks = None
+            if len(info["maskedColumns"]) > 0:
+                masks = np.load(maskName, mmap_mode='r')
+                if masks.shape != (len(info["maskedColumns"]), info["rows"]):
+                    return False
+        except (IOError, ValueError, KeyError):
+            return False
+
+        print("Reading {} (cached)".format(fname))
+        self.headers = info["headers"]
+        self.emptyColumn = info["emptyColumn"]
+        self.data = [values[colIdx] for colIdx in range(len(self.headers))]
+        self.valid = [None] * len(self.headers)
+        for maskIdx, colIdx in enumerate(info["maskedColumns"]):
+            self.valid[colIdx] = masks[maskIdx]
+        print("  {} columns, {} data rows, ".format(len(self.headers), info["rows"] - 1))
+        return True
+
+    def _storeCache(self, fname, cacheDir, values):
+        """Writes the parsed (columns x rows) array 'values' to the cache, errors are only reported."""
+        npyName, maskName, jsonName = self._cacheFileNames(fname, cacheDir)
+        maskedColumns = [colIdx for colIdx in range(len(self.valid)) if self.valid[colIdx] is not None]
+        try:
+            os.makedirs(cacheDir, exist_ok=True)
+            stat = os.stat(fname)
+            info = {
+                "version": PARSE_CACHE_VERSION,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "hash": self._fileHash(fname),
+                "rows": values.shape[1],
+                "headers": self.headers,
+                "emptyColumn": self.emptyColumn,
+                "sentinels": self.sentinels,
+                "maskedColumns": maskedColumns
+            }
+            # data files first, the description file marks the cache entry as complete
+            self._writeAtomic(npyName, lambda f: np.save(f, values), binary=True)
+            if len(maskedColumns) > 0:
+                self._writeAtomic(maskName, lambda f: np.save(f, np.stack([self.valid[colIdx]
+                                                                           for colIdx in maskedColumns])), binary=True)
+            self._writeAtomic(jsonName, lambda f: json.dump(info, f))
+        except IOError as e:
+            print("Cannot write parse cache for '{}': {}".format(fname, str(e)))
+
+    @staticmethod
+    def _writeAtomic(fname, write, binary=False):
+        """Calls write() with a temporary file that replaces the file 'fname' afterwards."""
+        tmpName = "{}.{}.tmp".format(fname, os.getpid())
+        if binary:
+            f = open(tmpName, 'wb')
+        else:
+            f = open(tmpName, 'w', encoding="utf-8")
+        with f:
+            write(f)
+        os.replace(tmpName, fname)
+
+    def _checkLine(self, l, lidx):
+        """
+        Removes a trailing empty token from line 'l' with index 'lidx' in the file. The first
+        line is stored as header, all other lines must have the same column count.
+        Returns the normalized line.
+        """
+        p = l.rfind('\t')
+        last = l[p + 1:].strip()
+        if len(last) == 0:
+            l = l[0:p]
+        else:
+            l = l[0:p + 1] + last
+        # header line
+        if lidx == 0:
+            self.headers = l.split('\t')
+            self.data = []
+            return l
+        # sanity check - enough columns in row?
+        columnCount = len(self.headers)
+        if l.count('\t') + 1 != columnCount:
+            raise RuntimeError(
+                "  Error: Column count {} in row #{} mismatches header column count {}".format(
+                    l.count('\t') + 1, lidx, columnCount))
+        return l
+
+    def _lineChunks(self, fobj, chunkSize):
+        """
+        Generator that yields the normalized data lines of the open file 'fobj' in lists of at
+        most 'chunkSize' lines, see _checkLine(). Reading stops at the first empty line.
+        """
+        lines = []
+        for lidx, l in enumerate(fobj):
+            if len(l.strip()) == 0:
+                break  # stop on first empty line
+            l = self._checkLine(l, lidx)
+            if lidx == 0:
+                continue
+            lines.append(l)
+            if len(lines) == chunkSize:
+                yield lines
+                lines = []
+        if len(lines) > 0:
+            yield lines
+
+    def _convertLines(self, lines, values, rowOffset):
+        """
+        Converts normalized data lines into the (columns x rows) float64 array 'values', a 0.0 is
+        stored in place of empty cells. 'rowOffset' is the index of the first line within the data,
+        used in error messages.
+
+        Returns a tuple (blankCells, error) with boolean arrays that mark the empty cells of each
+        column (None for columns without empty cells) and the error message for the first value
+        that couldn't be converted (None if successful). Lines after an invalid value are still
+        checked for empty cells.
+        """
+        blankCells = [None] * len(self.headers)
+
+        # fast path: all cells hold valid numbers
+        try:
+            values[:, :] = np.loadtxt(lines, delimiter='\t', dtype=np.float64, comments=None, ndmin=2).T
+            return blankCells, None
+        except ValueError:
+            pass  # empty cells or invalid numbers, handled line by line below
+
+        error = None
+        for rowidx, l in enumerate(lines):
+            tokens = l.split('\t')
+            try:
+                values[:, rowidx] = [float(t) for t in tokens]
+                continue
+            except ValueError:
+                pass
+            # only this line needs to be converted token by token
+            for colIdx, t in enumerate(tokens):
+                if len(t.strip()) == 0:
+                    values[colIdx, rowidx] = 0.0
+                    if blankCells[colIdx] is None:
+                        blankCells[colIdx] = np.zeros(len(lines), dtype=bool)
+                    blankCells[colIdx][rowidx] = True
+                    continue
+                try:
+                    values[colIdx, rowidx] = float(t)
+                except ValueError:
+                    if error is None:
+                        error = "Data conversion error for value '{}' in row {} and column {}, " \
+                                "keeping string value".format(t, rowOffset + rowidx, colIdx)
+        return blankCells, error
+
+    @staticmethod
+    def _blankCells(col):
+        """Returns a boolean array that marks the empty cells of the string array 'col'."""
+        blank = (col == '')
+        if not blank.all():
+            # cells with whitespace only are empty as well
+            nonBlank = ~blank
+            blank[nonBlank] = np.char.isspace(col[nonBlank])
+        return blank
+
+    @staticmethod
+    def _convertTokens(col, blank, rowOffset, colIdx):
+        """
+        Converts the string array 'col' to a float64 array, a 0.0 is stored in place of the
+        empty cells marked in 'blank'. 'rowOffset' and 'colIdx' locate the column in the file.
+
+        Returns a tuple (values, error) with the error message for the first value that
+        couldn't be converted (values is None then).
+        """
+        col = col.copy()
+        col[blank] = '0'
+        try:
+            return col.astype(np.float64), None
+        except ValueError:
+            # find first invalid value for the error message
+            for rowidx in range(len(col)):
+                try:
+                    float(col[rowidx])
+                except ValueError:
+                    error = "Data conversion error for value '{}' in row {} and column {}, " \
+                            "keeping string value".format(col[rowidx], rowOffset + rowidx, colIdx)
+                    return None, error
+            raise
+
     def removeEmptyCols(self):
         """All columns, that only contain data in the header row, are removed"""
         colCount = len(self.headers)
@@ -70,15 +438,19 @@ class TSVContainer:
         # now extract only data and header columns that are not empty
         remainingHeaders = []
         remainingData = []
+        remainingValid = []
         for colIdx in range(colCount):
             if self.emptyColumn[colIdx]:
                 print("Removing empty column {} '{}'".format(colIdx, self.headers[colIdx]))
             else:
                 remainingData.append(self.data[colIdx])
                 remainingHeaders.append(self.headers[colIdx])
+                if self.valid:
+                    remainingValid.append(self.valid[colIdx])
 
         self.data = remainingData
         self.headers = remainingHeaders
+        self.valid = remainingValid
         self.emptyColumn = [False] * len(self.headers)
 
     def emptyCols2ZeroCols(self):
@@ -93,64 +465,145 @@ class TSVContainer:
             if self.emptyColumn[colIdx]:
                 print("Filling column {} '{}' with zeroes".format(colIdx, self.headers[colIdx]))
                 self.data[colIdx] = emptyCol
+                if self.valid:
+                    self.valid[colIdx] = None
         self.emptyColumn = [False] * len(self.headers)
 
-    def interpolateHalfHourlyData(self):
-        """ Interpolates all data that is given with half hourly time steps for hourly outputs
+    def isHalfHourly(self):
+        """ Returns True if all time points are given with half hourly time steps, i.e. they
+        are all in the middle of an hour.
         """
-
-        # First we check if we have half hourly time steps
         isHalfHourly = True
 
         timeCol = self.data[0]
-        for rowidx in range(len(timeCol)):  # we check all rows to be sure
-            val = timeCol[rowidx]
-            if not str(val).endswith(".5"):
-                isHalfHourly = False
-                break
+        if isinstance(timeCol, np.ndarray) and timeCol.dtype.kind == 'f':
+            # same as checking str(val).endswith(".5"), float values cannot have a
+            # fractional part .5 in the range with exponential notation
+            isHalfHourly = bool(np.all(np.abs(np.fmod(timeCol, 1)) == 0.5))
+        else:
+            for rowidx in range(len(timeCol)):  # we check all rows to be sure
+                val = timeCol[rowidx]
+                if not str(val).endswith(".5"):
+                    isHalfHourly = False
+                    break
+        return isHalfHourly
+
+    @staticmethod
+    def _timeUnit(header):
+        """Returns the unit in the header label of a time column, e.g. 'min' for 'Time [min]'."""
+        p = header.find("[")
+        if p == -1:
+            return None
+        return header[p + 1:].split("]")[0].strip()
 
-        if not isHalfHourly:
+    @staticmethod
+    def convertTimes(times, fromHeader, toHeader):
+        """ Returns the time values 'times' of a time column with header label 'fromHeader' converted
+        to the unit in the header label 'toHeader', or None if one of the units is not in TIME_UNITS.
+        """
+        fromUnit = TIME_UNITS.get(TSVContainer._timeUnit(fromHeader))
+        toUnit = TIME_UNITS.get(TSVContainer._timeUnit(toHeader))
+        if fromUnit is None or toUnit is None:
+            return None
+        times = np.asarray(times, dtype=np.float64)
+        # the units are integer multiples of each other, dividing by the integer ratio is exact for whole units
+        if fromUnit >= toUnit:
+            return times * (fromUnit // toUnit)
+        return times / (toUnit // fromUnit)
+
+    def convertTimeUnit(self, timeHeader):
+        """ Converts the time column to the unit in the header label 'timeHeader', e.g. from
+        'Time [min]' to 'Zeit [h]', and renames the time column to 'timeHeader'.
+
+        Returns False if one of the units is not in TIME_UNITS.
+        """
+        timeCol = self.convertTimes(self.data[0], self.headers[0], timeHeader)
+        if timeCol is None:
             return False
+        self.data[0] = timeCol
+        self.headers[0] = timeHeader
+        return True
 
-        for colidx in range(len(self.data)):
-            col = self.data[colidx]
-            newDataCol = []
-            for rowidx in range(len(col)):
-                try:
-                    if colidx == 0 and rowidx == 0:
-                        # leave first line as it is
-                        newDataCol.append(float(str(col[rowidx]).split(".")[0]))
-                        continue
+    def interpolateHalfHourlyData(self):
+        """ Interpolates all data that is given with half hourly time steps for hourly outputs.
+        Columns read with readAsArrays() are interpolated as a whole, other columns value
+        by value.
+        """
+
+        # First we check if we have half hourly time steps
+        if not self.isHalfHourly():
+            return False
 
-                    if rowidx == 0:
-                        # for first row we just do not interpolate
-                        newDataCol.append(col[rowidx])
+        # overflows are raised, so that the invalid value is located and reported
+        with np.errstate(over='raise', invalid='raise'):
+            for colidx in range(len(self.data)):
+                col = self.data[colidx]
+                if isinstance(col, np.ndarray) and col.dtype.kind == 'f' and len(col) > 0:
+                    try:
+                        newDataCol = np.empty(len(col), dtype=np.float64)
+                        newDataCol[1:] = 0.5 * (col[:-1] + col[1:])
+                        if colidx == 0:
+                            # leave first line as it is, without fractional part
+                            newDataCol[0] = np.trunc(col[0])
+                        else:
+                            # for first row we just do not interpolate
+                            newDataCol[0] = col[0]
+                        self.data[colidx] = newDataCol
+                        self._interpolateValidity(colidx)
                         continue
+                    except ArithmeticError:
+                        pass  # interpolate value by value to locate the invalid value
 
-                    val1 = col[rowidx - 1]
-                    val2 = col[rowidx]
+                newDataCol = []
+                for rowidx in range(len(col)):
+                    try:
+                        if colidx == 0 and rowidx == 0:
+                            # leave first line as it is
+                            newDataCol.append(float(str(col[rowidx]).split(".")[0]))
+                            continue
 
-                    newVal = 0.5 * (val1 + val2)
+                        if rowidx == 0:
+                            # for first row we just do not interpolate
+                            newDataCol.append(col[rowidx])
+                            continue
 
-                    if colidx == 0:
-                        newDataCol.append(newVal)
-                    else:
-                        newDataCol.append(newVal)
+                        val1 = col[rowidx - 1]
+                        val2 = col[rowidx]
 
-                except:
-                    print(
-                        "Data interpolation error for value '{}' in row {} and column {}, keeping orignal value".format(
-                            col[rowidx], rowidx, colidx))
-                    return False
+                        newVal = 0.5 * (val1 + val2)
 
-            self.data[colidx] = newDataCol
+                        if colidx == 0:
+                            newDataCol.append(newVal)
+                        else:
+                            newDataCol.append(newVal)
+
+                    except:
+                        print(
+                            "Data interpolation error for value '{}' in row {} and column {}, keeping orignal value".format(
+                                col[rowidx], rowidx, colidx))
+                        return False
+
+                self.data[colidx] = newDataCol
+                self._interpolateValidity(colidx)
 
         return True
 
+    def _interpolateValidity(self, colidx):
+        """Updates the validity mask of an interpolated column, interpolated values are invalid if one of the
+        original values was invalid."""
+        if colidx >= len(self.valid) or self.valid[colidx] is None:
+            return
+        valid = self.valid[colidx]
+        newValid = np.empty(len(valid), dtype=bool)
+        newValid[0] = valid[0]
+        newValid[1:] = valid[:-1] & valid[1:]
+        self.valid[colidx] = newValid
+
     def convert2Double(self):
         """
-        Converts read data (except first line) to floats. A 0.0 is stored in place of
-        empty cells.
+        Converts read data (except first line) to floats. Each column is converted as a
+        whole and stored as numpy float64 array, a 0.0 is stored in place of empty cells.
+        Empty cells and NaN values are marked as invalid in the validity masks 'valid'.
 
         **Return Value**
 
@@ -158,20 +611,16 @@ class TSVContainer:
         """
         if len(self.headers) < 1:
             return
+        self.valid = [None] * len(self.data)
         for colidx in range(len(self.data)):
-            col = self.data[colidx]
-            for rowidx in range(len(col)):
-                if len(col[rowidx].strip()) == 0:
-                    col[rowidx] = 0  # in-place substitution
-                else:
-                    try:
-                        val = float(col[rowidx])  # in-place substitution
-                        col[rowidx] = val
-                    except:
-                        print(
-                            "Data conversion error for value '{}' in row {} and column {}, keeping string value".format(
-                                col[rowidx], rowidx, colidx))
-                        return False
+            col = np.array(self.data[colidx], dtype=str)
+            blank = self._blankCells(col)
+            values, error = self._convertTokens(col, blank, 0, colidx)
+            if error is not None:
+                print(error)
+                return False
+            self.data[colidx] = values
+            self.valid[colidx] = self._validityMask(values, blank)
         return True
 
     def write(self, fname):
@@ -189,7 +638,7 @@ class TSVContainer:
                         if val == 0:
                             newLine = newLine + "0\t"
                         else:
-                            if type(val) is float:
+                            if isinstance(val, (float, np.floating)):
                                 newLine = newLine + "{:.6}\t".format(val)
                             else:
                                 newLine = newLine + "{}\t".format(val)
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Alignment of the time column of a tool result file with the time column
+# of the reference results.
+#
+# Time points are looked up with a binary search in the sorted time column,
+# so aligning two data sets is O(n log n) instead of O(n²) for repeated
+# list lookups. All columns of a file share the time column, hence the
+# index maps are computed once per tool result file and applied to every
+# variable.
+#
+# Time points that are not part of the other time column, e.g. a tool with
+# 10 minute output and reference results on the full hour that is not a
+# multiple of it, are resampled (see TimeResampling.py). So are the interval
+# means of '(mean)' columns on the finer time grid, which are averaged over
+# the intervals of the coarser time grid instead of picked.
+
+import numpy as np
+
+from TimeResampling import Resampler
+
+# absolute tolerance for comparing time points, same unit as the time column
+TIME_TOLERANCE = 1e-6
+
+
+def findTimeIndexes(timeColumn, timePoints, tolerance=TIME_TOLERANCE):
+    """
+    Returns an integer array with the index of the first entry in 'timeColumn' that
+    matches each of the 'timePoints' within the tolerance, or -1 if there is none.
+    """
+    timeColumn = np.asarray(timeColumn, dtype=float)
+    timePoints = np.asarray(timePoints, dtype=float)
+    # stable sort, so that for duplicate time points the first occurrence is found
+    order = np.argsort(timeColumn, kind='stable')
+    sortedTimes = timeColumn[order]
+    pos = np.searchsorted(sortedTimes, timePoints - tolerance, side='left')
+    indexes = np.full(len(timePoints), -1, dtype=np.int64)
+    candidates = pos < len(sortedTimes)
+    found = np.zeros(len(timePoints), dtype=bool)
+    found[candidates] = np.abs(sortedTimes[pos[candidates]] - timePoints[candidates]) <= tolerance
+    indexes[found] = order[pos[found]]
+    return indexes
+
+
+class TimeAlignment:
+    """
+    Index maps that convert the data of a tool result file and the reference results
+    to a common time column, in case the time columns have different lengths.
+
+    Some tools cannot produce output in under hourly mannor, then the reference results
+    are reduced to the time points of the tool data. If the tool data contains more time
+    points the tool data is reduced to the time points of the reference results instead.
+    If the reduced data misses some time points of the common time column, it is resampled.
+    """
+
+    def __init__(self, timeColumnRef, timeColumnData, tolerance=TIME_TOLERANCE):
+        self.timeColumnRef = timeColumnRef
+        self.timeColumnData = timeColumnData
+        self.refLength = len(timeColumnRef)
+        self.dataLength = len(timeColumnData)
+        # index arrays into reference and tool data, None if data is used unchanged
+        self.refIndexes = None
+        self.dataIndexes = None
+        # Resampler objects for reference and tool data that is reduced to the common time column,
+        # used for interval means and, if index arrays are None, for all columns
+        self.refResampler = None
+        self.dataResampler = None
+        # notes printed when the alignment is applied
+        self.messages = []
+        # error message, if time columns cannot be aligned
+        self.error = ""
+        # True if the time columns are identical
+        self.equal = False
+        # True if the time columns have the same length but different values
+        self.mismatch = False
+        # True if the data has to be converted to a common time column
+        self.needsConversion = False
+
+        try:
+            self.equal = np.array_equal(timeColumnData, timeColumnRef)
+            self.mismatch = not self.equal and not np.allclose(timeColumnData, timeColumnRef)
+        except Exception:
+            # time columns with different lengths cannot be compared
+            self.needsConversion = True
+
+        if not self.needsConversion:
+            return
+        if len(timeColumnData) < len(timeColumnRef):
+            self._reduceReference(tolerance)
+        elif len(timeColumnData) > len(timeColumnRef):
+            if len(timeColumnData) < 2:
+                self.error = "Tool data has less then 2 entries."
+            elif len(timeColumnRef) < 2:
+                self.error = "Reference data has less then 2 entries."
+            else:
+                stepSizeData = timeColumnData[1] - timeColumnData[0]
+                stepSizeRef = timeColumnRef[1] - timeColumnRef[0]
+                if stepSizeData > stepSizeRef:
+                    self._reduceBoth(tolerance)
+                else:
+                    self._reduceData(tolerance)
+
+    def _resampler(self, sourceTimes, targetTimes, tolerance, required):
+        """
+        Returns a Resampler between the time columns, or None if the time columns are too short.
+        Then the error is set if the resampler is 'required'.
+        """
+        try:
+            return Resampler(sourceTimes, targetTimes, tolerance)
+        except ValueError as e:
+            if required:
+                self.error = str(e)
+            return None
+
+    def _reduceReference(self, tolerance):
+        """Picks the reference data at all time points of the tool data."""
+        indexes = findTimeIndexes(self.timeColumnRef, self.timeColumnData, tolerance)
+        missing = np.flatnonzero(indexes < 0)
+        self.refResampler = self._resampler(self.timeColumnRef, self.timeColumnData, tolerance, len(missing) > 0)
+        if self.error:
+            return
+        if len(missing) > 0:
+            self.messages.append("Time step of tool data {} was not in reference data. Resampling reference "
+                                 "data.".format(float(self.timeColumnData[missing[0]])))
+        else:
+            self.refIndexes = indexes
+        # time column data from tool data set is now set for reference data set
+        self.timeColumnRef = self.timeColumnData
+
+    def _reduceBoth(self, tolerance):
+        """Picks tool and reference data at all time points of the tool data within the reference time range."""
+        self.messages.append("Tool data step size is less then reference data step size and contains more data "
+                             "then reference. Converting reference data.")
+        timeData = np.asarray(self.timeColumnData, dtype=float)
+        # we do not have reference data for all tool data time steps, so we skip all
+        # data that is not included
+        inRange = (timeData >= self.timeColumnRef[0]) & (timeData <= self.timeColumnRef[-1])
+        timePoints = timeData[inRange]
+        indexes = findTimeIndexes(self.timeColumnRef, timePoints, tolerance)
+        missing = np.flatnonzero(indexes < 0)
+        self.refResampler = self._resampler(self.timeColumnRef, timePoints, tolerance, len(missing) > 0)
+        if self.error:
+            return
+        if len(missing) > 0:
+            self.messages.append("Could not find tool data time step {} in time column of reference data. "
+                                 "Resampling reference data.".format(float(timePoints[missing[0]])))
+        else:
+            self.refIndexes = indexes
+        self.dataIndexes = findTimeIndexes(timeData, timePoints, 0)
+        self.timeColumnRef = timePoints.tolist()
+        self.timeColumnData = self.timeColumnRef
+
+    def _reduceData(self, tolerance):
+        """Picks the tool data at all time points of the reference data."""
+        indexes = findTimeIndexes(self.timeColumnData, self.timeColumnRef, tolerance)
+        missing = np.flatnonzero(indexes < 0)
+        self.dataResampler = self._resampler(self.timeColumnData, self.timeColumnRef, tolerance, len(missing) > 0)
+        if self.error:
+            return
+        if len(missing) > 0:
+            self.messages.append("Could not find reference data time step {} in time column of tool data. "
+                                 "Resampling tool data.".format(float(self.timeColumnRef[missing[0]])))
+        else:
+            self.dataIndexes = indexes
+        # time column data from tool data set is now set for reference data set
+        self.timeColumnData = self.timeColumnRef
+
+    @property
+    def resampled(self):
+        """True if any data is resampled, then the converted data may hold invalid values."""
+        return (self.refResampler is not None and self.refIndexes is None) or \
+            (self.dataResampler is not None and self.dataIndexes is None)
+
+    @staticmethod
+    def _convert(values, indexes, resampler, meanValues):
+        if resampler is None or (indexes is not None and not np.any(meanValues)):
+            return values if indexes is None else np.asarray(values)[indexes]
+        if indexes is None:
+            return resampler.apply(values, meanValues)
+        # interval means are averaged, instantaneous values are picked at the common time points
+        if np.ndim(meanValues) == 0:
+            return resampler.means(values)
+        values = np.asarray(values, dtype=float)
+        result = values[indexes]
+        result[:, meanValues] = resampler.means(values[:, meanValues])
+        return result
+
+    def apply(self, refData, testData, meanValues=False):
+        """
+        Returns the reference and tool data converted to the common time column. The data
+        may also be 2-D arrays with one column per variable, then all variables are
+        converted at once.
+
+        'meanValues' tells which columns hold interval means ('(mean)' in the header label),
+        either a single flag or one flag per column. Values that cannot be resampled are NaN,
+        see applyValid().
+        """
+        if np.ndim(meanValues) > 0:
+            meanValues = np.asarray(meanValues, dtype=bool)
+        refData = self._convert(refData, self.refIndexes, self.refResampler, meanValues)
+        testData = self._convert(testData, self.dataIndexes, self.dataResampler, meanValues)
+        return refData, testData
+
+    @staticmethod
+    def _convertValid(valid, length, indexes, resampler, meanValues):
+        if valid is None:
+            valid = np.ones(length, dtype=bool)
+        if resampler is None or (indexes is not None and not meanValues):
+            return valid if indexes is None else np.asarray(valid)[indexes]
+        return resampler.applyValid(valid, meanValues)
+
+    def applyValid(self, valid, meanValues=False):
+        """
+        Returns the validity masks of the reference and tool data of a single variable converted
+        to the common time column. 'valid' is a tuple with both masks, or None if all values are
+        valid. Resampled values are invalid if they depend on invalid values or cannot be resampled.
+        """
+        refValid, dataValid = (None, None) if valid is None else valid
+        return (self._convertValid(refValid, self.refLength, self.refIndexes, self.refResampler, meanValues),
+                self._convertValid(dataValid, self.dataLength, self.dataIndexes, self.dataResampler, meanValues))
+
+
+class StreamingAlignment:
+    """
+    Finds the reference time points in the time column of a tool result file that is read chunk
+    by chunk, for tools whose time column holds all reference time points: the same time column
+    or a finer one, like in TimeAlignment._reduceData() without resampling. The tool data is
+    picked at the reference time points.
+
+    All other time columns need the whole tool data to be aligned or resampled, then match()
+    or finish() raise a ValueError.
+    """
+
+    def __init__(self, timeColumnRef, tolerance=TIME_TOLERANCE):
+        self.timeColumnRef = np.asarray(timeColumnRef, dtype=float)
+        self.tolerance = tolerance
+        if np.any(np.diff(self.timeColumnRef) < 0):
+            raise ValueError("Time column of reference data is not sorted.")
+        # index of the next reference time point to find
+        self.refIndex = 0
+        # number of tool rows so far and their first time points
+        self.dataLength = 0
+        self.firstTimes = []
+
+    def match(self, times):
+        """
+        Returns two index arrays for the next chunk of the tool's time column 'times': the rows of
+        the chunk at reference time points and the indexes of these reference time points.
+        """
+        times = np.asarray(times, dtype=float)
+        if len(times) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if np.any(np.diff(times) < 0) or (self.firstTimes and times[0] < self.lastTime):
+            raise ValueError("Time column of tool data is not sorted.")
+        # reference time points whose first matching tool time point, if any, is part of this chunk
+        end = np.searchsorted(self.timeColumnRef, times[-1] + self.tolerance, side='right')
+        refIndexes = np.arange(self.refIndex, end)
+        dataIndexes = np.searchsorted(times, self.timeColumnRef[refIndexes] - self.tolerance, side='left')
+        missing = np.flatnonzero(np.abs(times[dataIndexes] - self.timeColumnRef[refIndexes]) > self.tolerance)
+        if len(missing) > 0:
+            raise ValueError("Could not find reference data time step {} in time column of tool data.".format(
+                float(self.timeColumnRef[refIndexes[missing[0]]])))
+        self.refIndex = end
+        self.firstTimes.extend(times[:2 - len(self.firstTimes)])
+        self.lastTime = times[-1]
+        self.dataLength += len(times)
+        return dataIndexes, refIndexes
+
+    def finish(self):
+        """Checks that all reference time points were found, once the whole time column was matched."""
+        if self.refIndex < len(self.timeColumnRef):
+            raise ValueError("Could not find reference data time step {} in time column of tool data.".format(
+                float(self.timeColumnRef[self.refIndex])))
+        if self.dataLength < len(self.timeColumnRef):
+            raise ValueError("Tool data has less time points than reference data.")
+        # tools with larger time steps than the reference, but more time points, are aligned differently
+        if self.dataLength > len(self.timeColumnRef) and len(self.timeColumnRef) > 1 and \
+                self.firstTimes[1] - self.firstTimes[0] > self.timeColumnRef[1] - self.timeColumnRef[0]:
+            raise ValueError("Tool data step size is larger than reference data step size.")
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Resampling of result columns to the time points of another time grid.
+#
+# Tools may write their results on another time grid than the reference
+# results, e.g. every 10 minutes instead of hourly. According to the data
+# storage rules (doc/Datenablageregeln.md) a column is either
+#
+# - an instantaneous value at time t, or
+# - an interval mean, marked with '(mean)' in the header label, that is the
+#   mean value of the interval that ends at time t.
+#
+# Instantaneous values are interpolated linearly at the target time points.
+# Interval means are averaged over all source samples within each target
+# interval (t[j-1], t[j]], so that a target value is again the mean of its
+# interval. The index maps only depend on the two time columns, they are
+# computed once and applied to all columns with vectorized operations.
+
+import numpy as np
+
+
+class Resampler:
+    """
+    Converts columns given at the sorted time points 'sourceTimes' to the sorted time points
+    'targetTimes'. Target values that cannot be calculated are NaN and marked invalid, i.e.
+    instantaneous values outside of the source time range and interval means of intervals
+    without any source sample. Time points within 'tolerance' are treated as equal.
+    """
+
+    def __init__(self, sourceTimes, targetTimes, tolerance):
+        sourceTimes = np.asarray(sourceTimes, dtype=float)
+        targetTimes = np.asarray(targetTimes, dtype=float)
+        if len(sourceTimes) < 2 or len(targetTimes) < 2:
+            raise ValueError("Resampling needs at least 2 time points.")
+        self.sourceLength = len(sourceTimes)
+        self.targetLength = len(targetTimes)
+
+        # linear interpolation between the source samples 'lower' and 'upper' = lower + 1
+        pos = np.searchsorted(sourceTimes, targetTimes, side='left')
+        self.upper = np.clip(pos, 1, len(sourceTimes) - 1)
+        self.lower = self.upper - 1
+        span = sourceTimes[self.upper] - sourceTimes[self.lower]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(span > 0, (targetTimes - sourceTimes[self.lower]) / span, 0.0)
+        self.weight = np.clip(weight, 0.0, 1.0)
+        self.inRange = (targetTimes >= sourceTimes[0] - tolerance) & (targetTimes <= sourceTimes[-1] + tolerance)
+        # source time points that match a target time point are taken as they are
+        exactLower = np.abs(sourceTimes[self.lower] - targetTimes) <= tolerance
+        exactUpper = np.abs(sourceTimes[self.upper] - targetTimes) <= tolerance
+        self.weight[exactLower] = 0.0
+        self.weight[exactUpper & ~exactLower] = 1.0
+
+        # source sample k belongs to the target interval j with t[j-1] < s[k] <= t[j], the first
+        # interval has the length of the second one
+        bins = np.searchsorted(targetTimes, sourceTimes - tolerance, side='left')
+        intervalStart = targetTimes[0] - (targetTimes[1] - targetTimes[0])
+        used = (bins < len(targetTimes)) & (sourceTimes > intervalStart + tolerance)
+        # the source time column is sorted, so the used samples are a contiguous range
+        usedIndexes = np.flatnonzero(used)
+        self.first = int(usedIndexes[0]) if len(usedIndexes) > 0 else 0
+        self.last = int(usedIndexes[-1]) + 1 if len(usedIndexes) > 0 else 0
+        self.counts = np.bincount(bins[self.first:self.last], minlength=len(targetTimes))
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+
+    def instantaneous(self, values):
+        """Returns the values linearly interpolated at the target time points, 'values' may be 2-D."""
+        values = np.asarray(values, dtype=float)
+        weight = self.weight.reshape((-1,) + (1,) * (values.ndim - 1))
+        lower = values[self.lower]
+        upper = values[self.upper]
+        with np.errstate(invalid='ignore', over='ignore'):
+            result = np.where(weight == 0, lower, np.where(weight == 1, upper, lower + (upper - lower) * weight))
+        result[~self.inRange] = np.nan
+        return result
+
+    def _intervalSums(self, values):
+        """Returns the sums of the source samples in each target interval, undefined for empty intervals."""
+        # a trailing zero row for empty intervals at the end, np.add.reduceat() needs valid start indexes
+        used = np.concatenate((values[self.first:self.last], np.zeros((1,) + values.shape[1:], dtype=values.dtype)))
+        return np.add.reduceat(used, self.starts, axis=0)
+
+    def means(self, values):
+        """Returns the interval means at the target time points, 'values' may be 2-D."""
+        values = np.asarray(values, dtype=float)
+        counts = self.counts.reshape((-1,) + (1,) * (values.ndim - 1))
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            return np.where(counts > 0, self._intervalSums(values) / np.maximum(counts, 1), np.nan)
+
+    def apply(self, values, meanValues=False):
+        """
+        Returns the resampled values. 'meanValues' tells which columns hold interval means, either
+        a single flag or, for 2-D values, one flag per column.
+        """
+        if np.ndim(meanValues) == 0:
+            return self.means(values) if meanValues else self.instantaneous(values)
+        meanValues = np.asarray(meanValues, dtype=bool)
+        result = self.instantaneous(values)
+        if meanValues.any():
+            result[:, meanValues] = self.means(np.asarray(values, dtype=float)[:, meanValues])
+        return result
+
+    def instantaneousValid(self, valid):
+        """Returns the validity mask of the interpolated values, they need valid source samples on both sides."""
+        valid = np.asarray(valid, dtype=bool)
+        return self.inRange & (valid[self.lower] | (self.weight == 1)) & (valid[self.upper] | (self.weight == 0))
+
+    def meansValid(self, valid):
+        """Returns the validity mask of the interval means, they need at least one and only valid source samples."""
+        invalid = self._intervalSums((~np.asarray(valid, dtype=bool)).astype(np.int64))
+        return (self.counts > 0) & (invalid == 0)
+
+    def applyValid(self, valid, meanValues=False):
+        """Returns the validity mask of a resampled column, see apply()."""
+        return self.meansValid(valid) if meanValues else self.instantaneousValid(valid)
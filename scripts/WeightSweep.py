@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Sensitivity of the scores and badges to the weight factors.
+#
+# Within an evaluation period the weighted score is a linear combination of
+# one term per norm (see weightedScore()), divided by the sum of the weight
+# factors. With the terms of all results as matrix, the scores for many
+# candidate weight vectors are a few array operations per period.
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ResultsTable import NORM_COLUMNS, BADGES
+from PrintFuncs import *
+
+# norms with a linear score term, and 'Max Difference' as last weight column. 'Max Difference' enters
+# the score whenever it is listed in 'WeightFactors.tsv', also with weight 0, so a missing
+# 'Max Difference' is NaN in the weight vectors
+LINEAR_NORMS = ["CVRMSE", "Daily Amplitude CVRMSE", "MBE", "RMSEIQR", "MSE", "NMBE", "NRMSE", "RMSE", "RMSLE",
+                "R squared", "std dev"]
+WEIGHT_COLUMNS = LINEAR_NORMS + ["Max Difference"]
+
+# number of candidates evaluated at once, limits the size of the score matrices
+CANDIDATE_CHUNK = 1024
+
+# standard deviation of the log-normal factors for random variations of the weight factors
+RANDOM_SPREAD = 0.5
+RANDOM_SEED = 1
+
+# badge codes ordered from worst to best, for counting improvements and deteriorations
+BADGE_RANK = {0: 0, 2: 1, 1: 2}
+
+
+def scoreTerms(norms):
+    """
+    Returns the score terms of the norms in LINEAR_NORMS as matrix with one row per result,
+    'norms' is a dictionary with arrays of the norm values. Same terms as in weightedScore().
+    """
+    average = norms['Average']
+    terms = [100.0 - abs(norms['CVRMSE']),
+             100.0 - abs(norms['Daily Amplitude CVRMSE']),
+             100.0 - 100.0 * abs(norms['MBE']) / average,
+             100.0 - abs(norms['RMSEIQR']),
+             100.0 - 100 * abs(norms['MSE']) / average,
+             100.0 - abs(norms['NMBE']),
+             100.0 - abs(norms['NRMSE']),
+             100.0 - 100.0 * abs(norms['RMSE']) / average,
+             100.0 - abs(norms['RMSLE']) / average,
+             norms['R squared'],
+             100.0 - abs(norms['std dev']) / average]
+    return np.stack(terms, axis=1)
+
+
+def candidateScores(table, rows, weights):
+    """
+    Returns the (not rounded) scores of the results 'rows' of the ResultsTable for all candidate
+    weight vectors, as matrix with one row per result and one column per candidate. 'weights' has
+    one row per candidate with the weight factors in the order of WEIGHT_COLUMNS, see weightVector().
+    """
+    linearWeights = weights[:, :-1]
+    hasMaxDiff = ~np.isnan(weights[:, -1])
+    maxDiffWeights = np.where(hasMaxDiff, weights[:, -1], 1.0)
+
+    # normation of weightedScore(), summed in the same order
+    weightSum = np.zeros(len(weights))
+    for k in range(len(LINEAR_NORMS)):
+        weightSum = weightSum + linearWeights[:, k]
+    weightSum = np.where(weightSum > 0, weightSum, 999999)
+    weightSum = np.where(hasMaxDiff, np.where(weightSum == 999999, 1, weightSum + 1), weightSum)
+
+    counts = table.periodCounts[rows]
+    score = np.zeros((len(rows), len(weights)))
+    with np.errstate(all='ignore'):
+        for i in range(counts.max(initial=0)):
+            norms = {norm: table.periodNorms[rows, i, k] for k, norm in enumerate(NORM_COLUMNS)}
+            # terms are added one by one like in weightedScore(), so that the current weight factors
+            # reproduce the scores exactly
+            terms = scoreTerms(norms)
+            numerator = np.zeros((len(rows), len(weights)))
+            for k in range(len(LINEAR_NORMS)):
+                numerator = numerator + terms[:, k, np.newaxis] * linearWeights[:, k]
+            maxDiff = 80.0 + 20.0 * (maxDiffWeights - np.abs(norms['Max Difference'])[:, np.newaxis]) / \
+                maxDiffWeights
+            numerator += np.where(hasMaxDiff, maxDiff, 0)
+            periodScore = np.where((np.abs(norms['Average']) < 1e-4)[:, np.newaxis], 0, score + numerator / weightSum)
+            score = np.where((i < counts)[:, np.newaxis], periodScore, score)
+        return score / counts[:, np.newaxis]
+
+
+def weightVector(weightFactors):
+    """
+    Returns the weight factors of a test case (see readWeightFactors()) in the order of WEIGHT_COLUMNS.
+    Missing norms have weight 0, a missing 'Max Difference' is NaN.
+    """
+    return np.array([weightFactors.get(norm, np.nan if norm == "Max Difference" else 0) for norm in WEIGHT_COLUMNS],
+                    dtype=float)
+
+
+def readCandidates(fname):
+    """
+    Reads candidate weight vectors from a tab-separated file with one candidate per row and
+    the norm names of 'WeightFactors.tsv' as column headers. Missing norms and empty cells have
+    weight 0, except for 'Max Difference': without a value it does not enter the score, like
+    in weightVector().
+    """
+    try:
+        df = pd.read_csv(fname, sep="\t", encoding="utf-8")
+    except Exception as e:
+        raise RuntimeError("Cannot read candidate weight factors '{}': {}".format(fname, str(e)))
+    unknown = [col for col in df.columns if col not in WEIGHT_COLUMNS]
+    if unknown:
+        raise RuntimeError("Unknown norms in candidate weight factors '{}': {}".format(fname, ", ".join(unknown)))
+    weights = np.zeros((len(df), len(WEIGHT_COLUMNS)))
+    weights[:, -1] = np.nan
+    for k, norm in enumerate(WEIGHT_COLUMNS):
+        if norm in df.columns:
+            values = df[norm].to_numpy(dtype=float)
+            weights[:, k] = values if norm == "Max Difference" else np.nan_to_num(values, nan=0.0)
+    return weights
+
+
+def randomFactors(count, seed=RANDOM_SEED):
+    """
+    Returns 'count' random log-normal factors for each weight factor, the first candidate has all
+    factors 1 and reproduces the current weight factors.
+    """
+    rng = np.random.default_rng(seed)
+    factors = rng.lognormal(0.0, RANDOM_SPREAD, size=(count, len(WEIGHT_COLUMNS)))
+    factors[0] = 1
+    return factors
+
+
+def sweep(table, weightFactors, candidates, relative=False):
+    """
+    Evaluates the candidate weight vectors for the results of all test cases in 'weightFactors',
+    a dictionary that maps the test case directory to its current weight factors. With 'relative'
+    True the candidates are factors for the current weight factors of each test case, otherwise
+    all test cases get the candidate weight factors.
+
+    Badges are compared with the badges in the table. Returns a DataFrame with one row per
+    candidate: the number of changed badges, the badge counts and the score distribution.
+    Only results with calculated scores are taken into account.
+    """
+    caseRows = dict()
+    for testCaseDir in sorted(weightFactors.keys()):
+        rows = np.flatnonzero((table.data["TestCaseDir"] == testCaseDir) & (table.periodCounts > 0))
+        current = weightVector(weightFactors[testCaseDir])
+        weights = candidates * current if relative else candidates
+        # results that miss a norm used by any candidate cannot be evaluated, the average is part
+        # of all linear score terms and 'Max Difference' is used whenever it has a weight
+        used = ["Average"] + [norm for k, norm in enumerate(LINEAR_NORMS) if np.any(weights[:, k] != 0)]
+        if np.any(~np.isnan(weights[:, -1])):
+            used.append("Max Difference")
+        missing = table.skipped[rows][:, [NORM_COLUMNS.index(norm) for norm in used]].any(axis=1)
+        if missing.any():
+            printWarning("    {}: {} results need norms that were not calculated and are left out. "
+                         "Evaluate the test case with --full-report.".format(testCaseDir, missing.sum()))
+            rows = rows[~missing]
+        if len(rows) > 0:
+            caseRows[testCaseDir] = (rows, weights)
+
+    badgeRank = np.vectorize(BADGE_RANK.get, otypes=[np.int64])
+    summaries = []
+    for first in range(0, len(candidates), CANDIDATE_CHUNK):
+        chunk = slice(first, first + CANDIDATE_CHUNK)
+        scores = []
+        ranks = []
+        for rows, weights in caseRows.values():
+            scores.append(candidateScores(table, rows, weights[chunk]))
+            ranks.append(badgeRank(table.data["simQbadge"][rows]))
+        if not scores:
+            break
+        scores = np.concatenate(scores)
+        currentRanks = np.concatenate(ranks)[:, np.newaxis]
+        badges = np.where(scores >= 90, 1, np.where(scores >= 80, 2, 0))
+        newRanks = (scores >= 80).astype(np.int64) + (scores >= 90)
+
+        summary = pd.DataFrame({"Candidate": np.arange(first, first + scores.shape[1])})
+        summary["Badge Changes"] = (newRanks != currentRanks).sum(axis=0)
+        summary["Improved"] = (newRanks > currentRanks).sum(axis=0)
+        summary["Deteriorated"] = (newRanks < currentRanks).sum(axis=0)
+        for code in [1, 2, 0]:
+            summary[BADGES[code]] = (badges == code).sum(axis=0)
+        scores = np.maximum(scores, 0)
+        with warnings.catch_warnings():
+            # candidates without any valid score get NaN statistics
+            warnings.simplefilter("ignore", RuntimeWarning)
+            summary["Mean Score"] = np.nanmean(scores, axis=0)
+            for q, name in [(0, "Min Score"), (10, "P10 Score"), (50, "Median Score"), (90, "P90 Score"),
+                            (100, "Max Score")]:
+                summary[name] = np.nanpercentile(scores, q, axis=0)
+        summaries.append(summary)
+
+    if not summaries:
+        return pd.DataFrame()
+    result = pd.concat(summaries, ignore_index=True)
+    for k, norm in enumerate(WEIGHT_COLUMNS):
+        result.insert(1 + k, norm, candidates[:, k])
+    return result
+
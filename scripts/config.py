@@ -1,3 +1,15 @@
 # defines whether print functions shall print with color or not
 USE_COLORS = True
 
+
+# values in tool result files that mark outputs a tool cannot provide, e.g. -273.15 for
+# temperatures; cells with these values are not evaluated, like empty cells and NaN values
+SENTINEL_VALUES = [-273.15]
+
+# the norms of all tools of a test case are only calculated together if the tool result files
+# of the test case are at most this large in total [bytes], since all of them are kept in memory
+BATCH_SIZE_LIMIT = 200 * 1024 * 1024
+
+# tool result files larger than this [bytes] are read chunk by chunk and scored without keeping
+# their data in memory, their data is then not exported to the dashboard
+STREAMING_SIZE_LIMIT = 500 * 1024 * 1024